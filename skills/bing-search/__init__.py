@@ -17,46 +17,137 @@
 import logging
 import azure.functions as func
 import json
-import http.client, urllib.parse
+import urllib.parse
+from shared_code import hedging, https_pool, lru_cache, settings, single_flight, skill_base, skill_io, sqlite_cache
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
+    # The body is parsed only once and the output is serialized only once. See shared_code/skill_io.py
+    return skill_io.handle_request(req, compose_response)
+
+
+# Maximum number of Bing Entity Search requests in flight, per process. Application setting BING_SEARCH_MAX_IN_FLIGHT.
+# The records of a batch are processed concurrently, the order of the values and the errors per record are kept.
+# Use 1 to process the records one by one.
+MAX_IN_FLIGHT = settings.get('BING_SEARCH_MAX_IN_FLIGHT', 8)
+
+# Search Parameters
+subscriptionKey = '3d5f223640594a23a30ec3c99a195862'
+host = 'mybingentitysearch.cognitiveservices.azure.com'
+path = '/bing/v7.0/entities'
+mkt = 'en-US' # Change as you want  
+
+# Optional global variable: hedged requests, to cut the tail latency. Disabled by default.
+# A request slower than the BING_SEARCH_HEDGING_PERCENTILE of the latest latencies is sent again, and the first
+# response wins. BING_SEARCH_HEDGING_MAX_EXTRA caps the extra requests, as a fraction of all requests.
+# Application settings BING_SEARCH_HEDGING (true/false), BING_SEARCH_HEDGING_PERCENTILE, BING_SEARCH_HEDGING_MAX_EXTRA.
+HEDGER = None
+if settings.get('BING_SEARCH_HEDGING', False):
+    HEDGER = hedging.Hedger('bing-search',
+                            percentile=settings.get('BING_SEARCH_HEDGING_PERCENTILE', 95.0),
+                            maxExtra=settings.get('BING_SEARCH_HEDGING_MAX_EXTRA', 0.05),
+                            maxWorkers=2 * MAX_IN_FLIGHT)
+
+# Global variable: keep-alive HTTPS connections, reused by all records and all invocations of this process.
+# Application settings BING_SEARCH_POOL_SIZE (default is MAX_IN_FLIGHT, twice that with hedging) and
+# BING_SEARCH_TIMEOUT (seconds).
+POOL = https_pool.HTTPSPool(host,
+                            size=settings.get('BING_SEARCH_POOL_SIZE', MAX_IN_FLIGHT * (2 if HEDGER else 1)),
+                            timeout=settings.get('BING_SEARCH_TIMEOUT', 10.0))
+
+# Function to call the API
+def get_suggestions (query):
+    params = '?mkt=' + mkt + '&q=' + urllib.parse.quote (query)
+    headers = {'Ocp-Apim-Subscription-Key': subscriptionKey}
+    if HEDGER is not None:
+        return HEDGER.call (lambda: POOL.request ("GET", path + params, None, headers).data)
+    return POOL.request ("GET", path + params, None, headers).data
+
+# Global variable: the descriptions already found, by market and query. The API is not called again for them.
+# Queries are compared in lower case and with single white spaces: "Microsoft" and " MICROSOFT" are the same.
+# Application settings BING_SEARCH_CACHE_SIZE (entries, 0 disables the cache) and BING_SEARCH_CACHE_TTL (seconds).
+CACHE = lru_cache.LRUCache(maxSize=settings.get('BING_SEARCH_CACHE_SIZE', 10000),
+                           ttl=settings.get('BING_SEARCH_CACHE_TTL', 86400.0))
+
+# Optional global variable: a persistent cache in a local SQLite file, that survives cold starts and recycles.
+# The API is not called again for the entities found yesterday. Checked after the in-memory cache.
+# Application settings BING_SEARCH_CACHE_DB (file path, no persistent cache if empty) and BING_SEARCH_CACHE_DB_TTL (seconds).
+PERSISTENT_CACHE = None
+if settings.get('BING_SEARCH_CACHE_DB'):
+    PERSISTENT_CACHE = sqlite_cache.SQLiteCache(settings.get('BING_SEARCH_CACHE_DB'),
+                                                ttl=settings.get('BING_SEARCH_CACHE_DB_TTL', 30 * 86400.0))
+
+def cache_key (query):
+    return (mkt, ' '.join(query.split()).lower())
+
+# Global variable: concurrent invocations looking for the same entity share one single lookup
+FLIGHTS = single_flight.SingleFlight()
+
+# The description of the first entity found, from the caches or from the API
+def get_description (query):
+    key = cache_key (query)
+    description = CACHE.get (key)
+    if description is lru_cache.MISSING:
+        # The first caller does the lookup, the concurrent callers for the same key wait for its result
+        description = FLIGHTS.do (key, lambda: load_description (query, key))
+    return description
+
+# Not in the in-memory cache: from the persistent cache or from the API
+def load_description (query, key):
+    description = lru_cache.MISSING
+    if PERSISTENT_CACHE is not None:
+        description = PERSISTENT_CACHE.get ('\t'.join(key))
+    if description is lru_cache.MISSING:
+        result = get_suggestions (query)
+        # You can get many other things back, as the url. We are getting the description
+        # Example: description = json.loads(result)['entities']['value'][0]['url']
+        description = json.loads(result)['entities']['value'][0]['description']
+        if PERSISTENT_CACHE is not None:
+            # Written by flush(), once per invocation
+            PERSISTENT_CACHE.put ('\t'.join(key), description)
+    CACHE.put (key, description)
+    return description
+
+# For transform_batch: the description, or the error to be reported for the records with this query
+def find_description (query):
     try:
-        body = json.dumps(req.get_json())
-    except ValueError:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-    
-    if body:
-        result = compose_response(body)
-        return func.HttpResponse(result, mimetype="application/json")
-    else:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-
-
-def compose_response(json_data):
-    values = json.loads(json_data)['values']
-
-    # Prepare the Output before the loop
-    results = {}
-    results["values"] = []
-
+        return get_description (query)
+    except Exception as error:
+        return error
+
+
+def compose_response(body):
+    # The records loop is in shared_code/skill_base.py, calling transform_value for each record, in a thread pool
+    # shared_code/skill_io.py serializes the output keeping the original accentuation
+    results = skill_base.compose_response(body, transform_value, transform_batch)
+    # The API calls are the requests of the connections pool
+    logging.info('Bing Entity Search connections: %s', POOL.stats())
+    logging.info('Bing Entity Search cache: %s', CACHE.stats())
+    logging.info('Bing Entity Search single flight: %s', FLIGHTS.stats())
+    if HEDGER is not None:
+        logging.info('Bing Entity Search hedging: %s', HEDGER.stats())
+    if PERSISTENT_CACHE is not None:
+        PERSISTENT_CACHE.flush()
+        logging.info('Bing Entity Search persistent cache: %s', PERSISTENT_CACHE.stats())
+    return results
+
+## Perform an operation on all records of the batch, concurrently
+## Identical queries within the batch are sent only once
+def transform_batch(values):
+    queries = {}
     for value in values:
-        outputRecord = transform_value(value)
-        if outputRecord != None:
-            results["values"].append(outputRecord)
-    # Keeping the original accentuation with ensure_ascii=False
-    return json.dumps(results, ensure_ascii=False)
+        if skill_base.validate(value) is None:
+            query = str(value['data']['text'])
+            queries.setdefault(cache_key(query), query)
+    found = skill_base.transform_concurrently('bing-search', list(queries.values()), find_description, MAX_IN_FLIGHT)
+    descriptions = dict(zip(queries, found))
+    return [transform_value(value, descriptions) for value in values]
 
 ## Perform an operation on a record
-def transform_value(value):
+## descriptions are the ones already found by transform_batch
+def transform_value(value, descriptions=None):
     try:
         recordId = value['recordId']
     except AssertionError  as error:
@@ -78,27 +169,14 @@ def transform_value(value):
     try:                
         # Getting the Search Entity
         myString = str(value['data']['text'])
-        
-        # Search Parameters
-        subscriptionKey = '3d5f223640594a23a30ec3c99a195862'
-        host = 'mybingentitysearch.cognitiveservices.azure.com'
-        path = '/bing/v7.0/entities'
-        mkt = 'en-US' # Change as you want  
-        query = myString
-        params = '?mkt=' + mkt + '&q=' + urllib.parse.quote (query)
-
-        # Function to call the API
-        def get_suggestions ():
-            headers = {'Ocp-Apim-Subscription-Key': subscriptionKey}
-            conn = http.client.HTTPSConnection (host)
-            conn.request ("GET", path + params, None, headers)
-            response = conn.getresponse ()
-            return response.read()
-
-        result = get_suggestions ()
-        # You can get many other things back, as the url. We are getting the description
-        # Example: myString = json.dumps(json.loads(result)['entities']['value'][0]['url'])
-        myString = json.dumps(json.loads(result)['entities']['value'][0]['description'])
+
+        if descriptions is None:
+            description = get_description (myString)
+        else:
+            description = descriptions[cache_key (myString)]
+            if isinstance(description, Exception):
+                raise description
+        myString = json.dumps(description)
 
     except:
         return (
@@ -113,24 +191,3 @@ def transform_value(value):
                 "text": myString
                     }
             })
-    
-
-
-# Testing the function
-
-
-myInput = {
-    "values": [
-      {
-        "recordId": "0",
-        "data":
-           {
-            "text": "Flamengo"
-           }
-      }
-     
-    ]
-}
-
-inputTest = json.dumps(myInput)
-compose_response (inputTest)
\ No newline at end of file
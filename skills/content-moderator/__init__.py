@@ -9,52 +9,203 @@
 #
 # Specific comments
 # - This detects PII from the input strings.
-# - Content Moderator API input limit is 1024 characters, that's why we have substring.
-# - Characters after 1024 positions will be ignored. Change the code and add a loop if you need to process the all string.  
+# - Content Moderator API input limit is 1024 characters, that's why the text is split in chunks.
+# - The all string is processed: chunks end on white spaces and overlap, so a phone number or an email is never cut in half.
+# - Obvious PII, like emails and phone numbers, is detected locally first. The API is only called when there is no local hit.
+# - The verdicts are cached by a hash of the text, identical texts like disclaimers and footers are screened only once.
+# - The requests are paced to the TPS quota of the API, and throttled requests (HTTP 429) are retried with a backoff.
+# - The chunks are screened concurrently. As soon as one chunk has PII, the remaining chunks are cancelled.
 # - This skill returns True or False. Change the code if you need anything different.
 # - This code is Python 3.x only!!!!!
 
 import logging
 import azure.functions as func
-import json
+import concurrent.futures
+import hashlib
 import re
-import http.client, urllib.request, urllib.parse, urllib.error, base64
+import threading
+import urllib.parse
+from shared_code import https_pool, lru_cache, pii_patterns, rate_limit, settings, single_flight, skill_base, skill_io
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
+    # The body is parsed only once and the output is serialized only once. See shared_code/skill_io.py
+    return skill_io.handle_request(req, compose_response)
+
+
+# Maximum number of Content Moderator requests in flight, per process. Application setting CONTENT_MODERATOR_MAX_IN_FLIGHT.
+# The records of a batch are processed concurrently, the order of the values and the errors per record are kept.
+# Use 1 to send one request at a time.
+MAX_IN_FLIGHT = settings.get('CONTENT_MODERATOR_MAX_IN_FLIGHT', 4)
+
+# Global variable: the requests of all records and chunks share it, so there are never more than MAX_IN_FLIGHT of them
+IN_FLIGHT = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+# Chunks of a document, at most 1024 characters because of the API limit. Application settings:
+# CONTENT_MODERATOR_CHUNK_SIZE, CONTENT_MODERATOR_CHUNK_OVERLAP (characters repeated in the next chunk, longer than
+# the longest PII you expect), and CONTENT_MODERATOR_CHUNKS_IN_FLIGHT (chunks of the same document screened concurrently,
+# within the MAX_IN_FLIGHT requests of the process).
+CHUNK_SIZE = settings.get('CONTENT_MODERATOR_CHUNK_SIZE', 1023)
+CHUNK_OVERLAP = settings.get('CONTENT_MODERATOR_CHUNK_OVERLAP', 64)
+CHUNKS_IN_FLIGHT = settings.get('CONTENT_MODERATOR_CHUNKS_IN_FLIGHT', 4)
+
+# Using the Content Moderator API
+########### Python 3.x #############
+headers = {
+# Request headers
+# ACTION REQUIRED!!!
+# REPLACE THE STRING BELOW WITH YOUR KEY!!
+'Content-Type': 'text/plain; charset=utf-8',
+'Ocp-Apim-Subscription-Key': 'your-content-moderator-api-key',
+}
+
+language = 'eng' # Change as you want
+
+params = urllib.parse.urlencode({
+# Request parameters
+# Unfortunately, the Content Moderator uses 3 letters for language code
+    #'autocorrect': 'False',
+    'PII': 'True',
+    #'listId': 'False',
+    #'classify': 'False',
+    'language': language
+})
+
+# ACTION REQUIRED!!!
+# Replace the string your-content-moderator-azure-region with the region code that you used to create the API
+host = 'your-content-moderator-azure-region.api.cognitive.microsoft.com'
+
+# Global variable: local pre-screen of the obvious PII formats, see shared_code/pii_patterns.py
+# Application setting CONTENT_MODERATOR_PRE_SCREEN, use false to send all texts to the API.
+PRE_SCREEN = pii_patterns.PIIPreScreen() if settings.get('CONTENT_MODERATOR_PRE_SCREEN', True) else None
+
+# Global variable: keep-alive HTTPS connections, reused by all chunks, records and invocations of this process
+POOL = https_pool.HTTPSPool(host, size=MAX_IN_FLIGHT)
+
+# Global variable: all requests of the process share one token bucket, paced to CONTENT_MODERATOR_TPS requests per
+# second (10 for the S0 tier, 1 for the free tier). Throttled requests are retried up to CONTENT_MODERATOR_MAX_RETRIES
+# times, with a jittered exponential backoff that respects the Retry-After header. See shared_code/rate_limit.py
+# The quota is per API key: with many processes or instances, divide the TPS among them. Use 0 to disable the pacing.
+LIMITER = rate_limit.RateLimiter(settings.get('CONTENT_MODERATOR_TPS', 10.0),
+                                 maxRetries=settings.get('CONTENT_MODERATOR_MAX_RETRIES', 5))
+
+# Global variable: the verdicts already known, by language and hash of the text. The API is not called again for them.
+# Texts are compared with single white spaces. Only the hash is kept, not the text.
+# Application settings CONTENT_MODERATOR_CACHE_SIZE (entries, 0 disables the cache) and CONTENT_MODERATOR_CACHE_TTL (seconds).
+CACHE = lru_cache.LRUCache(maxSize=settings.get('CONTENT_MODERATOR_CACHE_SIZE', 10000),
+                           ttl=settings.get('CONTENT_MODERATOR_CACHE_TTL', 86400.0))
+
+def cache_key(text):
+    return (language, hashlib.blake2b(' '.join(text.split()).encode('utf-8'), digest_size=16).hexdigest())
+
+# Global variable: concurrent records with the same text share one single screening
+FLIGHTS = single_flight.SingleFlight()
+
+
+# Splits the text in chunks of at most CHUNK_SIZE characters, ending on white spaces.
+# Each chunk starts on the first white space of the last CHUNK_OVERLAP characters of the previous one.
+def split_chunks(text):
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = len(text)
+        if end - start > CHUNK_SIZE:
+            end = text.rfind(' ', start + 1, start + CHUNK_SIZE + 1)
+            if end <= start + CHUNK_OVERLAP:
+                # No white space, a hard cut
+                end = start + CHUNK_SIZE
+        chunk = text[start:end]
+        #To avoid the API to process no data. 
+        if chunk.strip() != '':
+            chunks.append(chunk)
+        if end == len(text):
+            break
+        nextStart = text.find(' ', end - CHUNK_OVERLAP, end)
+        start = nextStart if nextStart > start else end - CHUNK_OVERLAP
+    return chunks
+
+
+# One request, when one of the MAX_IN_FLIGHT slots is free. The retries wait for the rate limit without a slot.
+def send(url, chunk):
+    with IN_FLIGHT:
+        return POOL.request("POST", url, chunk.encode('utf-8'), headers)
+
+
+# Screens one chunk. We are just detecting if there is PII, returning True or False.
+# Change the code as you need
+def screen(chunk):
+    url = "/contentmoderator/moderate/v1.0/ProcessText/Screen?%s" % params
+    response = LIMITER.request(lambda: send(url, chunk))
+    # An error, or still throttled after the retries, is not a verdict
+    if response.status != 200:
+        raise RuntimeError('Content Moderator API returned HTTP %d' % response.status)
+    return str(response.data).find('PII') > 0
+
+
+# A confident local hit returns True without calling the API, then the verdict is taken from the cache
+def detect_pii(text):
+    if PRE_SCREEN is not None and PRE_SCREEN.match(text):
+        return True
+    key = cache_key(text)
+    verdict = CACHE.get(key)
+    if verdict is lru_cache.MISSING:
+        # The first caller screens the text, the concurrent callers with the same text wait for its verdict
+        verdict = FLIGHTS.do(key, lambda: load_verdict(text, key))
+    return verdict
+
+
+def load_verdict(text, key):
+    verdict = screen_text(text)
+    CACHE.put(key, verdict)
+    return verdict
+
+
+# Screens all chunks of the text, at most CHUNKS_IN_FLIGHT at the same time. Stops at the first chunk with PII.
+def screen_text(text):
+    chunks = split_chunks(text)
+    if len(chunks) <= 1:
+        return any(screen(chunk) for chunk in chunks)
+
+    # Threads for the chunks of all records, their requests wait for IN_FLIGHT
+    executor = skill_base.executor('content-moderator-chunks', MAX_IN_FLIGHT * CHUNKS_IN_FLIGHT)
+    remaining = iter(chunks)
+    pending = set()
     try:
-        body = json.dumps(req.get_json())
-    except ValueError:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-    
-    if body:
-        result = compose_response(body)
-        return func.HttpResponse(result, mimetype="application/json")
-    else:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-
-
-def compose_response(json_data):
-    values = json.loads(json_data)['values']
-    
-    # Prepare the Output before the loop
-    results = {}
-    results["values"] = []
-    
-    for value in values:
-        outputRecord = transform_value(value)
-        if outputRecord != None:
-            results["values"].append(outputRecord)
-    # Keeping the original accentuation with ensure_ascii=False
-    return json.dumps(results, ensure_ascii=False)
+        while True:
+            for chunk in remaining:
+                pending.add(executor.submit(screen, chunk))
+                if len(pending) >= CHUNKS_IN_FLIGHT:
+                    break
+            if not pending:
+                return False
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.result():
+                    return True
+    finally:
+        # Early exit or error: the chunks not sent yet are cancelled
+        for future in pending:
+            future.cancel()
+
+
+def compose_response(body):
+    # The records loop is in shared_code/skill_base.py, calling transform_value for each record, in a thread pool
+    # shared_code/skill_io.py serializes the output keeping the original accentuation
+    results = skill_base.compose_response(body, transform_value, transform_batch)
+    # The API calls are the requests of the connections pool
+    logging.info('Content Moderator connections: %s', POOL.stats())
+    logging.info('Content Moderator rate limit: %s', LIMITER.stats())
+    logging.info('Content Moderator cache: %s', CACHE.stats())
+    logging.info('Content Moderator single flight: %s', FLIGHTS.stats())
+    if PRE_SCREEN is not None:
+        logging.info('Content Moderator local pre-screen: %s', PRE_SCREEN.stats())
+    return results
+
+## Perform an operation on all records of the batch, concurrently
+def transform_batch(values):
+    return skill_base.transform_concurrently('content-moderator', values, transform_value, MAX_IN_FLIGHT)
 
 ## Perform an operation on a record
 def transform_value(value):
@@ -78,55 +229,17 @@ def transform_value(value):
 
     try:                
         # Getting the document text 
-        # Only the 1024 first characters!!!!!!
-        # To process the all string, change the code as you need.
         myString = value['data']['text']
-        myString = str(myString)[:1023]
+        myString = str(myString)
 
         # Replacing special Characters with withe spaces
         # The order matters!! Be careful!!
         myString = re.sub(r'\r\n',' ',myString)
         myString = re.sub(r'\t',' ',myString)
         myString = re.sub(r'\n',' ',myString)
- 
-        #To avoid the API to process no data. 
-        if (myString != '') and (myString != ' '):
-
-            # Using the Content Moderator API
-            ########### Python 3.x #############
-            headers = {
-            # Request headers
-            # ACTION REQUIRED!!!
-            # REPLACE THE STRING BELOW WITH YOUR KEY!!
-            'Content-Type': 'text/plain',
-            'Ocp-Apim-Subscription-Key': 'your-content-moderator-api-key',
-            }
-
-            params = urllib.parse.urlencode({
-            # Request parameters
-            # Unfortunately, the Content Moderator uses 3 letters for language code
-                #'autocorrect': 'False',
-                'PII': 'True',
-                #'listId': 'False',
-                #'classify': 'False',
-                'language': 'eng'
-            })
-
-            # ACTION REQUIRED!!!
-            # Replace the string your-content-moderator-azure-region with the region code that you used to create the API
-            conn = http.client.HTTPSConnection('your-content-moderator-azure-region.api.cognitive.microsoft.com')
-            conn.request("POST", "/contentmoderator/moderate/v1.0/ProcessText/Screen?%s" % params, myString, headers)
-            response = conn.getresponse()
-            data = response.read()
-            conn.close()
 
-            # returing the data 
-            myString = str(data)
-
-        # We are just detecting if there is PII, returning True or False.
-        # Change the code as you need
-
-        if myString.find('PII') > 0:
+        # All chunks of the text, using the Content Moderator API
+        if detect_pii(myString):
             myString = 'True'
         else:
             myString = 'False'
@@ -144,36 +257,3 @@ def transform_value(value):
                 "text": myString
                     }
             })
-    
-
-
-# Testing the function
-
-myInput = {
-    "values": [
-      {
-        "recordId": "0",
-        "data":
-           {
-            "text": ["Flamengo phone numer is 206-999-1981. The email address is contato@flamengo.com ."]
-           }
-      } ,
-        {
-        "recordId": "1",
-        "data":
-           {
-            "text": ["Flamengo is the new champion!!"]
-           }
-      } ,
-    {
-        "recordId": "2",
-        "data":
-           {
-            "text": []
-           }
-      } 
-    ]
-}
-
-inputTest = json.dumps(myInput)
-compose_response (inputTest)
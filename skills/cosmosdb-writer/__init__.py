@@ -11,49 +11,371 @@
 # - This code removes duplicates from a list. It is case sensitive: "Flamengo" is different from  "FLAMENGO" and both will be inserted.
 # - This custom skill gets the input, maybe a list from keyPhrases or entities extraction, and loads EACH ELEMENT as a document in a CosmosDb Collection
 # - Change the code as you want: You can group the elements and insert one document per Cognitive Search document. That's a very good idea, BTW. 
+#   With the application setting COSMOSDB_WRITER_MODE=records, one document per record is written, with the list of its elements.
 # - This code works great with CosmosDb Emulator! Check it out! https://docs.microsoft.com/en-us/azure/cosmos-db/local-emulator#installation
+# - azure.cosmos is a heavy import. It is imported by warm_up(), called by the first request, not at cold start.
+# - The client, the database, and the container are created once per process and reused by all records and invocations.
+# - The items of all records of a batch are grouped by partition key and written concurrently, with one transactional
+#   batch per partition key. Errors are still reported per record.
+# - The partition key strategy is pluggable: the value itself, hashed buckets, or a synthetic key. The writes per partition
+#   key are counted and the hottest ones are logged after each batch.
+# - The writes adapt to the provisioned RU/s: fewer writes in flight after a throttled request (HTTP 429), and throttled
+#   writes are retried in place, after the retry-after of Cosmos DB. The RUs consumed by each batch are logged.
+# - The ids are derived from the partition key and the value, and the documents are upserted: running the indexer again
+#   doesn't duplicate documents. The documents written recently are not written again, they cost no RUs.
 
 import logging
 import azure.functions as func
+import collections
+import hashlib
 import json
-from azure.cosmos import exceptions, CosmosClient, PartitionKey
-import uuid
+import random
+import threading
+import time
+from shared_code import lru_cache, rate_limit, settings, skill_base, skill_io
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
+    # The body is parsed only once and the output is serialized only once. See shared_code/skill_io.py
+    return skill_io.handle_request(req, compose_response)
+
+
+# Initialize the Cosmos client
+# ACTION REQUIRED!!!
+# Application settings COSMOSDB_WRITER_ENDPOINT and COSMOSDB_WRITER_KEY, or replace the strings below
+endpoint = settings.get('COSMOSDB_WRITER_ENDPOINT', 'your-CosmosDb-URI')
+key = settings.get('COSMOSDB_WRITER_KEY', 'your-CosmosDb-key')
+
+# Use the names that you want. Application settings COSMOSDB_WRITER_DATABASE and COSMOSDB_WRITER_CONTAINER.
+# Customize the container as you want: person names, key phrases, etc.
+database_name = settings.get('COSMOSDB_WRITER_DATABASE', 'MyCustomSkillData')
+container_name = settings.get('COSMOSDB_WRITER_CONTAINER', 'Organizations')
+
+# The throughput, used only when the database or the container are created. Application settings:
+# - COSMOSDB_WRITER_THROUGHPUT_MODE: manual (default, COSMOSDB_WRITER_THROUGHPUT RU/s for the container), autoscale
+#   (up to COSMOSDB_WRITER_AUTOSCALE_MAX RU/s for the container, 10% of it when idle), or shared (COSMOSDB_WRITER_THROUGHPUT
+#   RU/s for the database, shared by all its containers).
+throughput_mode = settings.get('COSMOSDB_WRITER_THROUGHPUT_MODE', 'manual')
+throughput = settings.get('COSMOSDB_WRITER_THROUGHPUT', 400)
+autoscale_max = settings.get('COSMOSDB_WRITER_AUTOSCALE_MAX', 4000)
+
+# The partition key strategy. Application setting COSMOSDB_WRITER_PARTITION_KEY:
+# - value (default): the name itself, the path is /name. A very common value is always written to the same partition.
+# - hash: one of COSMOSDB_WRITER_PARTITION_BUCKETS buckets, from a hash of the name. The writes are spread evenly and
+#   each bucket gets bigger transactional batches. The path is /pk.
+# - synthetic: the first letter of the name and the bucket, like "f-17". Spread like hash, but the prefix still
+#   groups similar names. The path is /pk.
+# A new strategy needs a new container: the partition key path of a container can't be changed.
+partition_strategy = settings.get('COSMOSDB_WRITER_PARTITION_KEY', 'value')
+partition_buckets = settings.get('COSMOSDB_WRITER_PARTITION_BUCKETS', 100)
+partition_path = '/name' if partition_strategy == 'value' else '/pk'
+
+# The layout of the documents. Application setting COSMOSDB_WRITER_MODE:
+# - items (default): one document per element of the list, {"id": ..., "name": "FLAMENGO"}
+# - records: one document per record, {"id": ..., "name": "document key", "items": ["FLAMENGO", "VASCO"]}
+#   The document key is the "key" input of the skill, like the key of the index. It is required in this mode: the
+#   recordId is only unique within a batch, the records of the next batches would replace the documents of this one.
+MODE = settings.get('COSMOSDB_WRITER_MODE', 'items')
+FIELDS = ('text', 'key') if MODE == 'records' else ('text',)
+DUPLICATE_KEY_MESSAGE = "Another record of the batch has the same 'key' and a different list."
+
+# Maximum number of Cosmos DB write requests in flight, per process. Application setting COSMOSDB_WRITER_MAX_IN_FLIGHT.
+# Use 1 to write the partition keys one by one.
+MAX_IN_FLIGHT = settings.get('COSMOSDB_WRITER_MAX_IN_FLIGHT', 8)
+
+# Global variable: the Cosmos DB writes in flight, at most MAX_IN_FLIGHT. Halved after a throttled write (HTTP 429)
+# and increased again after successful writes, to stay under the provisioned RU/s.
+LIMIT = rate_limit.AdaptiveLimit(MAX_IN_FLIGHT)
+
+# The Cosmos DB SDK doesn't retry throttled requests, it would hide them from LIMIT: a throttled write is retried here,
+# up to COSMOSDB_WRITER_MAX_RETRIES times (9 like the SDK), after the retry-after of Cosmos DB.
+# Optional application setting COSMOSDB_WRITER_MAX_RU: the RU/s of this process, 0 (default) doesn't pace the writes.
+# With many processes or instances, divide the provisioned RU/s among them.
+MAX_RETRIES = settings.get('COSMOSDB_WRITER_MAX_RETRIES', 9)
+RU_BUCKET = rate_limit.TokenBucket(settings.get('COSMOSDB_WRITER_MAX_RU', 0.0))
+
+# Maximum number of operations of a transactional batch, a Cosmos DB limit
+BATCH_OPERATIONS = 100
+
+# Global variable: the documents already written by this process, by container, id, and content. They are not written again.
+# Application settings COSMOSDB_WRITER_CACHE_SIZE (entries, 0 disables the cache) and COSMOSDB_WRITER_CACHE_TTL (seconds).
+# Use a TTL shorter than the time to live of the documents, if they expire in the container.
+WRITTEN = lru_cache.LRUCache(maxSize=settings.get('COSMOSDB_WRITER_CACHE_SIZE', 100000),
+                             ttl=settings.get('COSMOSDB_WRITER_CACHE_TTL', 3600.0))
+
+# Global variable: the writes per partition key of this process, to find the hot partitions.
+# Only the most written partition keys are kept, up to PARTITION_COUNTERS of them.
+PARTITION_COUNTERS = 10000
+_partitionWrites = collections.Counter()
+_partitionWritesLock = threading.Lock()
+
+# Imported by warm_up()
+CosmosClient = None
+PartitionKey = None
+ThroughputProperties = None
+ConnectionPolicy = None
+RetryOptions = None
+# Connection errors: the client is created again by the next request
+TRANSIENT_ERRORS = ()
+
+
+def warm_up():
+    # Imports azure.cosmos, only once per process
+    global CosmosClient, PartitionKey, ThroughputProperties, ConnectionPolicy, RetryOptions, TRANSIENT_ERRORS
+    if CosmosClient is None:
+        from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+        from azure.cosmos.exceptions import CosmosClientTimeoutError
+        from azure.cosmos.documents import ConnectionPolicy, RetryOptions
+        from azure.cosmos import CosmosClient, PartitionKey, ThroughputProperties
+        TRANSIENT_ERRORS = (ServiceRequestError, ServiceResponseError, CosmosClientTimeoutError, ConnectionError)
+
+
+# Global variable: the container, created by the first request. The concurrent requests wait for it.
+_container = None
+_containerLock = threading.Lock()
+
+
+def get_container():
+    global _container
+    container = _container
+    if container is None:
+        with _containerLock:
+            if _container is None:
+                warm_up()
+                # <create_cosmos_client>
+                # No throttling retries in the SDK, see MAX_RETRIES
+                policy = ConnectionPolicy()
+                policy.RetryOptions = RetryOptions(max_retry_attempt_count=0)
+                client = CosmosClient(endpoint, key, connection_policy=policy)
+                # </create_cosmos_client>
+
+                # <create_database_if_not_exists>
+                if throughput_mode == 'shared':
+                    database = client.create_database_if_not_exists(id=database_name, offer_throughput=throughput)
+                else:
+                    database = client.create_database_if_not_exists(id=database_name)
+                # </create_database_if_not_exists>
+
+                # Or you can insert the list under a document, keeping parity between CosmosDb and Azure Cognitive Search
+                # Using a good partition key improves the performance of database operations.
+                # Also, change the partition key as you want/need.
+                # <create_container_if_not_exists>
+                options = {}
+                if throughput_mode == 'autoscale':
+                    options['offer_throughput'] = ThroughputProperties(auto_scale_max_throughput=autoscale_max)
+                elif throughput_mode != 'shared':
+                    options['offer_throughput'] = throughput
+                _container = database.create_container_if_not_exists(
+                    id=container_name,
+                    partition_key=PartitionKey(path=partition_path),
+                    **options
+                )
+                # </create_container_if_not_exists>
+            container = _container
+    return container
+
+
+def reset_container(error):
+    # Only a connection error creates the client again. Other errors, like a conflict, keep it.
+    global _container
+    if isinstance(error, TRANSIENT_ERRORS):
+        logging.warning('Cosmos DB connection error, the client will be created again: %s', error)
+        with _containerLock:
+            _container = None
+
+
+def compose_response(body):
+    warm_up()
+    # The records loop is in shared_code/skill_base.py, calling transform_batch with all records
+    # shared_code/skill_io.py serializes the output keeping the original accentuation
+    results = skill_base.compose_response(body, transform_value, transform_batch)
+    # Hits are the documents not written again
+    logging.info('Cosmos DB written documents cache: %s', WRITTEN.stats())
+    logging.info('Cosmos DB hot partition keys (writes): %s', hot_partitions())
+    logging.info('Cosmos DB writes in flight: %s', LIMIT.stats())
+    return results
+
+# The document of an item. Change as you need!!
+def new_document(item):
+    document = {
+        'name': item
+    }
+    set_partition_key(document)
+    # The same item always has the same id, so it is upserted only once
+    document['id'] = document_id(partition_key(document), item)
+    return document
+
+# The document of a record, in records mode. Change as you need!!
+def new_record_document(documentKey, myStringList):
+    document = {
+        'name': documentKey,
+        'items': myStringList
+    }
+    set_partition_key(document)
+    # Upserted again when the list changes, it replaces the previous one
+    document['id'] = document_id(partition_key(document), documentKey)
+    return document
+
+# The documents of a record, in the layout of MODE
+def record_documents(value, myStringList):
+    if MODE == 'records':
+        return [new_record_document(str(value['data']['key']), myStringList)]
+    return [new_document(item) for item in myStringList]
+
+# The partition key strategies: the partition key value of a name. Add your own.
+def partition_bucket(name):
+    digest = hashlib.blake2b(json.dumps(name, ensure_ascii=False).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % partition_buckets
+
+def synthetic_partition_key(name):
+    return '%s-%d' % (str(name)[:1].lower(), partition_bucket(name))
+
+PARTITION_KEYS = {
+    'hash': lambda name: str(partition_bucket(name)),
+    'synthetic': synthetic_partition_key,
+}
+
+# Adds the partition key of the strategy to a new document, the value strategy uses the name
+def set_partition_key(document):
+    if partition_strategy != 'value':
+        document['pk'] = PARTITION_KEYS[partition_strategy](document['name'])
+
+# The partition key value of a document
+def partition_key(document):
+    return document['name'] if partition_strategy == 'value' else document['pk']
+
+# Counts the writes per partition key. Only the most written partition keys are kept.
+def count_writes(key, count):
+    with _partitionWritesLock:
+        _partitionWrites[key] += count
+        if len(_partitionWrites) > PARTITION_COUNTERS:
+            hottest = _partitionWrites.most_common(PARTITION_COUNTERS // 2)
+            _partitionWrites.clear()
+            _partitionWrites.update(dict(hottest))
+
+def hot_partitions(count=10):
+    with _partitionWritesLock:
+        return _partitionWrites.most_common(count)
+
+# A deterministic id, from the partition key and the value. Hexadecimal: no characters forbidden by Cosmos DB.
+def document_id(key, item):
+    return hashlib.blake2b(json.dumps([key, item], ensure_ascii=False).encode('utf-8'), digest_size=16).hexdigest()
+
+# The id is not enough for the documents of the records mode, their lists change. The content is hashed as well.
+def written_key(document):
+    content = json.dumps(document, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return (container_name, document['id'], hashlib.blake2b(content, digest_size=16).hexdigest())
+
+# Writes the documents of one partition key, a single upsert or a transactional batch.
+# Returns the error or None, and the RUs consumed.
+def write_group(container, key, documents):
+    charges = []
+    def response_hook(headers, result):
+        charges.append(float(headers.get('x-ms-request-charge', 0)))
+
+    attempt = 0
+    while True:
+        try:
+            with LIMIT:
+                if len(documents) == 1:
+                    container.upsert_item(body=documents[0], response_hook=response_hook)
+                else:
+                    container.execute_item_batch([('upsert', (document,)) for document in documents],
+                                                 partition_key=key, response_hook=response_hook)
+            break
+        except Exception as error:
+            if getattr(error, 'status_code', None) != 429 or attempt >= MAX_RETRIES:
+                reset_container(error)
+                return error, sum(charges)
+            # Throttled: fewer writes in flight, and the same write again after the retry-after of Cosmos DB
+            LIMIT.throttled()
+            headers = getattr(error, 'headers', None) or {}
+            delay = float(headers.get('x-ms-retry-after-ms', 0)) / 1000
+            time.sleep(delay + random.uniform(0, 0.1 * 2 ** attempt))
+            attempt += 1
+
+    LIMIT.succeeded()
+    # Waits until the RUs of this write are available in the RU/s of the process
+    RU_BUCKET.acquire(sum(charges))
+    count_writes(key, len(documents))
+    for document in documents:
+        WRITTEN.put(written_key(document), True)
+    return None, sum(charges)
+
+## Perform the operation on all records of the batch: the items are grouped by partition key and written concurrently
+def transform_batch(values):
+    outputRecords = []
+    groups = {}
+    # The content of each document id of the batch
+    contents = {}
+    for position, value in enumerate(values):
+        outputRecord = skill_base.validate(value, FIELDS)
+        if outputRecord is None:
+            try:
+                # Cleaning the list, removing duplicates
+                myStringList = list(dict.fromkeys(value['data']['text']))
+            except TypeError:
+                outputRecord = skill_base.error_record(value['recordId'])
+        if outputRecord is None:
+            documents = record_documents(value, myStringList)
+            # In records mode, two records with the same key and different lists would replace each other
+            for document in documents:
+                writtenKey = written_key(document)
+                if contents.setdefault(document['id'], writtenKey) != writtenKey:
+                    outputRecord = skill_base.error_record(value['recordId'], DUPLICATE_KEY_MESSAGE)
+        if outputRecord is None:
+            for document in documents:
+                # The same document in many records is written once, and not at all if it was written recently
+                group = groups.setdefault(partition_key(document), {})
+                if document['id'] in group:
+                    group[document['id']][1].append(position)
+                elif WRITTEN.get(written_key(document)) is lru_cache.MISSING:
+                    group[document['id']] = (document, [position])
+        outputRecords.append(outputRecord)
+
     try:
-        body = json.dumps(req.get_json())
-    except ValueError:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-    
-    if body:
-        result = compose_response(body)
-        return func.HttpResponse(result, mimetype="application/json")
-    else:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-
-
-def compose_response(json_data):
-    values = json.loads(json_data)['values']
-    
-    # Prepare the Output before the loop
-    results = {}
-    results["values"] = []
-    
-    for value in values:
-        outputRecord = transform_value(value)
-        if outputRecord != None:
-            results["values"].append(outputRecord)
-    # Keeping the original accentuation with ensure_ascii=False
-    return json.dumps(results, ensure_ascii=False)
+        container = get_container()
+    except Exception as error:
+        reset_container(error)
+        raise
+
+    # At most BATCH_OPERATIONS documents per transactional batch
+    writes = []
+    for key, group in groups.items():
+        group = list(group.values())
+        for start in range(0, len(group), BATCH_OPERATIONS):
+            writes.append((key, group[start:start + BATCH_OPERATIONS]))
+    start = time.monotonic()
+    outcomes = skill_base.transform_concurrently(
+        'cosmosdb-writer', writes,
+        lambda write: write_group(container, write[0], [document for document, _ in write[1]]), MAX_IN_FLIGHT)
+    if writes:
+        charge = sum(charge for _, charge in outcomes)
+        elapsed = time.monotonic() - start
+        logging.info('Cosmos DB batch: %d writes, %.2f RUs in %.2f s (%.1f RU/s)', len(writes), charge, elapsed,
+                     charge / elapsed if elapsed > 0 else 0.0)
+
+    # A record is OK when all its documents were written
+    failed = set()
+    for (key, group), (error, _) in zip(writes, outcomes):
+        if error is not None:
+            logging.warning('Cosmos DB write failed for partition key %r: %s', key, error)
+            for _, positions in group:
+                failed.update(positions)
+    for position, value in enumerate(values):
+        if outputRecords[position] is None:
+            if position in failed:
+                outputRecords[position] = skill_base.error_record(value['recordId'])
+            else:
+                outputRecords[position] = {
+                    "recordId": value['recordId'],
+                    "data": {
+                        "text": "OK"
+                            }
+                    }
+    return outputRecords
 
 ## Perform an operation on a record
 def transform_value(value):
@@ -66,7 +388,8 @@ def transform_value(value):
     try:         
         assert ('data' in value), "'data' field is required."
         data = value['data']        
-        assert ('text' in data), "'text' field is required in 'data' object."
+        for field in FIELDS:
+            assert (field in data), "'%s' field is required in 'data' object." % field
     except AssertionError  as error:
         return (
             {
@@ -83,49 +406,22 @@ def transform_value(value):
         # Cleaning the list, removing duplicates
         myStringList = list(dict.fromkeys(myStringList))
 
-        # Now let's insert one document for each organization in the list.
+        # Now let's insert one document for each organization in the list, or one document for the record.
         # Change as you need!!
 
-        # Initialize the Cosmos client
-        # Add your own data or use a better method to get this information
-        endpoint = "your-CosmosDb-URI"
-        key = 'your-CosmosDb-key'
-
-        # <create_cosmos_client>
-        client = CosmosClient(endpoint, key)
-        # </create_cosmos_client>
-
-        # Create a database
-        # Use the name that you want.
-        # <create_database_if_not_exists>
-        database_name = 'MyCustomSkillData'
-        database = client.create_database_if_not_exists(id=database_name)
-        # </create_database_if_not_exists>
-
-        # Create a container
-        # Customize as you want: person names, key phrases, etc.
-        # Or you can insert the list under a document, keeping parity between CosmosDb and Azure Cognitive Search
-        # Using a good partition key improves the performance of database operations.
-        # Also, change the partition key as you want/need.
-        # <create_container_if_not_exists>
-        container_name = 'Organizations'
-        container = database.create_container_if_not_exists(
-            id=container_name, 
-            partition_key=PartitionKey(path="/name"),
-            offer_throughput=400
-        )
-        # </create_container_if_not_exists>
-
-         # <create_item>
-        for item in myStringList:
-            newDoc = {
-                'id': str(uuid.uuid4()),
-                'name': item
-            }
-            container.create_item(body=newDoc)
-        # </create_item>
-
-    except:
+        # The client, the database, and the container of this process
+        container = get_container()
+
+         # <upsert_item>
+        for document in record_documents(value, myStringList):
+            if WRITTEN.get(written_key(document)) is lru_cache.MISSING:
+                error, _ = write_group(container, partition_key(document), [document])
+                if error is not None:
+                    raise error
+        # </upsert_item>
+
+    except Exception as error:
+        reset_container(error)
         return (
             {
             "recordId": recordId,
@@ -138,35 +434,3 @@ def transform_value(value):
                 "text": "OK"
                     }
             })
-
-
-# Testing the function
-
-myInput = {
-    "values": [
-      {
-        "recordId": "0",
-        "data":
-           {
-            "text": ["FLAMENGO","VASCO","FLAMENGO","FLUMINENSE","FLAMENGO"]
-           }
-      } ,
-        {
-        "recordId": "1",
-        "data":
-           {
-            "text": [""]
-           }
-      } ,    
-      {
-        "recordId": "2",
-        "data":
-           {
-            "text": ["FLAMENGO","Flamengo","flamengo","FLAMENGO"]
-           }
-      } 
-    ]
-}
-
-inputTest = json.dumps(myInput)
-compose_response (inputTest)
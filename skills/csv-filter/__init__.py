@@ -16,59 +16,49 @@
 # - File name is always terms.csv . If you want another name, chage it below.
 # - All data from both sources, input and csv, are converted to lower case for the strings comparison. Orinal case is returned.
 # - Only the matches are returned.
+# - The terms are matched with the Aho-Corasick automaton of shared_code/term_matcher.py, built once per process.
+#   Each text is scanned only once and the output string is built only once, no matter how many terms you have.
+# - Terms are removed as plain text, never as regular expressions, so a term never breaks the skill.
+# - Pontuaction is removed from the text, not from the terms: a term with pontuaction, like "C++", is never removed.
 
 import logging
 import azure.functions as func
-import csv
-import json
-import re
 import os
+from shared_code import skill_base, skill_io, terms_cache
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
-    try:
-        body = json.dumps(req.get_json())
-    except ValueError:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-    
-    if body:
-        result = compose_response(body)
-        return func.HttpResponse(result, mimetype="application/json")
-    else:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-
-
-def compose_response(json_data):
-    values = json.loads(json_data)['values']
-    
-    # Prepare the Output before the loop
-    results = {}
-    results["values"] = []
-
-    # Get reference data - csv file. Any plafform, any OS. 
-    __location__ = os.path.realpath(
-    os.path.join(os.getcwd(), os.path.dirname(__file__)))
-    myFile=os.path.join(__location__, 'terms.csv')
-    myFile=os.path.normpath(myFile)
-    with open (myFile,'r', encoding='latin-1') as csvList:
-        myList = list(csv.reader(csvList))
-    
-    for value in values:
-        outputRecord = transform_value(value,myList)
-        if outputRecord != None:
-            results["values"].append(outputRecord)
-    # Keeping the original accentuation with ensure_ascii=False
-    return json.dumps(results, ensure_ascii=False)
+    # The body is parsed only once and the output is serialized only once. See shared_code/skill_io.py
+    return skill_io.handle_request(req, compose_response)
+
+
+# Get reference data - csv file. Any plafform, any OS.
+# Global variable: it is loaded once per process and reloaded only when the file changes.
+# The matcher is built once for all records and all requests. Empty lines are ignored.
+__location__ = os.path.realpath(
+os.path.join(os.getcwd(), os.path.dirname(__file__)))
+myFile=os.path.join(__location__, 'terms.csv')
+myFile=os.path.normpath(myFile)
+TERMS = terms_cache.TermsCache(myFile)
+
+
+def warm_up():
+    # Loads the terms before the first request, if you want. Otherwise the first request loads them.
+    TERMS.get()
+
+
+def compose_response(body):
+    # Get reference data - csv file, from the global cache
+    matcher = TERMS.get()
+    logging.info('Terms cache: %s', TERMS.stats())
+
+    # The records loop is in shared_code/skill_base.py
+    # shared_code/skill_io.py serializes the output keeping the original accentuation
+    return skill_base.compose_response(body, lambda value: transform_value(value,matcher))
 
 ## Perform an operation on a record
-def transform_value(value,myList):
+def transform_value(value,matcher):
     try:
         recordId = value['recordId']
     except AssertionError  as error:
@@ -92,23 +82,11 @@ def transform_value(value,myList):
         recordId = value['recordId']
         text = value['data']['text']
 
-        # Adding and extra white spaces because I also add one for the terms
-        text=' '+text+' '
-
-        # Removing pontuaction, also because on the white spaces. 
-        # A term followed by comma or other pontuaction would not be extracted because on the white spaces
-        text = re.sub(r'[^\w\s]','',text)
-
-        #Now let's process for each term in the CSV
-        for term in myList:
-
-        #Convert to string and add spaces to avoid things like 'Africa' been removed from 'African'
-          myStr=' '+str(term[0])+' '
-          if text.lower().find(myStr.lower()) >= 0:
-            #remove the terms and white spaces that may have been left behind
-            text= re.sub(myStr, '', text)
-            text=text.strip()
-
+        # Adding the extra white spaces, removing pontuaction and removing all terms in one pass.
+        # A term followed by comma or other pontuaction would not be removed because on the white spaces
+        # White spaces avoid things like 'Africa' been removed from 'African'
+        # The white spaces that may have been left behind are also removed
+        text = matcher.remove(text)
 
     except:
         return (
@@ -123,49 +101,3 @@ def transform_value(value,myList):
                 "text": text
                     }
             })
-
-
-# Testing the function, forcing one error for the second record. 
-# Third record is an empty string. It will work.
-# The sample csv content is:
-# FLAMENGO
-# BARCELONA
-# REAL MADRID
-# MANCHESTER UNITED
-# LIVERPOOL
-# MILAN
-# JUVENTUS
-
-
-myInput = {
-    "values": [
-      {
-        "recordId": "0",
-        "data":
-           {
-             "text": "FLAMENGO is the new champion"
-           }
-      },
-        
-      {
-        "recordId": "1",
-        "data":
-           {
-            "text": "FLAMENGO beat LIVERPOOL in the 1981 World Cup final."
-            }
-      },
-        {
-        "recordId": "2",
-        "data":
-           {
-            "text": ""
-
-            }
-        },
-
-
-    ]
-}
-
-inputTest = json.dumps(myInput)
-compose_response (inputTest)
@@ -14,48 +14,157 @@
 #   2) If month and date are detected without year, it will return the date with today's year.
 #   3) The datafinder library will deal with empty stings and we will handle the outpout format
 # - For more details about datefinder: https://datefinder.readthedocs.io/en/latest/
+# - datefinder is a heavy import. It is imported by warm_up(), called by the first request, not at cold start.
+# - Fast path: the most common formats, 2019-11-23, 23/11/2019 and November 23rd 2019, are found by a precompiled regex,
+#   without datefinder. It is only used when datefinder would return the same date: nothing before the date looks like
+#   a date (digits, months, week days), and nothing after it could change the date. Otherwise datefinder is used.
+# - All dates mode, with the application setting DATES_EXTRACTOR_ALL_DATES=true: the output is the list of all distinct
+#   dates, in the order they are found, and "offsets" is the list of the character offsets of their first occurrence.
 
 import logging
 import azure.functions as func
 import re
-import datefinder
-import json
 import datetime
+import itertools
+from shared_code import settings, skill_base, skill_io
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
+    # The body is parsed only once and the output is serialized only once. See shared_code/skill_io.py
+    return skill_io.handle_request(req, compose_response)
+
+
+# Imported by warm_up()
+datefinder = None
+
+# All dates mode. Application settings DATES_EXTRACTOR_ALL_DATES (true/false, default false) and DATES_EXTRACTOR_LIMIT,
+# the maximum number of distinct dates per record (default 100, 0 for all of them).
+# datefinder parses the whole text before returning the first date, so the text is read in windows of
+# DATES_EXTRACTOR_WINDOW characters, ending on white spaces, and the scan stops at the limit.
+# DATES_EXTRACTOR_WINDOW_OVERLAP characters are repeated in the next window, longer than the longest date you expect.
+ALL_DATES = settings.get('DATES_EXTRACTOR_ALL_DATES', False)
+LIMIT = settings.get('DATES_EXTRACTOR_LIMIT', 100)
+WINDOW = settings.get('DATES_EXTRACTOR_WINDOW', 4096)
+WINDOW_OVERLAP = settings.get('DATES_EXTRACTOR_WINDOW_OVERLAP', 64)
+
+# Fast path. The first number of 05/11/2019 is the month, like in datefinder: 2019-05-11. 23/11/2019 is 2019-11-23.
+MONTHS = {'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7, 'august': 8,
+          'september': 9, 'october': 10, 'november': 11, 'december': 12, 'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4,
+          'jun': 6, 'jul': 7, 'aug': 8, 'sep': 9, 'sept': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+FAST_DATES = re.compile(
+    r'(?<![\w/.-])(?P<isoYear>\d{4})-(?P<isoMonth>\d{2})-(?P<isoDay>\d{2})(?![\w/-])'
+    r'|(?<![\w/.-])(?P<first>\d{1,2})/(?P<second>\d{1,2})/(?P<year>\d{4})(?![\w/-])'
+    r'|(?<!\w)(?P<monthName>' + '|'.join(sorted(MONTHS, key=len, reverse=True)) + r')\b\.?\s+'
+    r'(?P<day>\d{1,2})(?P<suffix>st|nd|rd|th)?,?\s+(?P<monthYear>\d{4})(?![\w/-])',
+    re.IGNORECASE)
+
+# The words datefinder reads as dates, in English, Spanish and Danish, even within other words: "mon" in "money"
+DATE_WORDS = 'jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|ene|abr|ago|dic|okt|maj|' \
+             'mon|tue|wed|thu|fri|sat|sun|man|tir|ons|tor|fre|lør|søn|today|tomorrow|yesterday|tonight|noon|midnight|now'
+# The words that datefinder joins to a date, and then can't parse it
+JOINED_WORDS = 'due|by|on|during|standard|daylight|savings|time|date|dated|of|to|through|between|until|at|day|' \
+               'first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|nineth|tenth|next|last|before|after|' \
+               'am|pm|a\\.m|p\\.m'
+DELIMITERS = r'[/:\-,.\s_+@]+'
+# Before the date: no digits and no date words at all, and no joined word just before it
+UNSAFE_BEFORE = re.compile(r'\d|' + DATE_WORDS, re.IGNORECASE)
+UNSAFE_JOINED_BEFORE = re.compile(
+    r'(?:until|during|between|through|first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|nineth|tenth|'
+    r'next|last)' + DELIMITERS + r'(?:[a-z]{2,5}' + DELIMITERS + r'){0,2}$', re.IGNORECASE)
+# After the date: no digits, date words or joined words in the next words. Short words, like time zones, are joined.
+UNSAFE_AFTER = re.compile(
+    r'(?:' + DELIMITERS + r'(?:[a-z]{2,5}' + DELIMITERS + r'){0,2})?(?:\d|' + DATE_WORDS + '|' + JOINED_WORDS + ')',
+    re.IGNORECASE)
+
+
+def warm_up():
+    # Imports datefinder, only once per process
+    global datefinder
+    if datefinder is None:
+        import datefinder
+
+
+# The first date of the text with the fast path, as YYYY-MM-DD, or None when datefinder must be used
+def find_first_date(text):
+    match = FAST_DATES.search(text)
+    if match is None:
+        return None
+    before = text[:match.start()]
+    if UNSAFE_BEFORE.search(before) or UNSAFE_JOINED_BEFORE.search(before) or UNSAFE_AFTER.match(text, match.end()):
+        return None
+
+    if match.group('isoYear'):
+        year, month, day = int(match.group('isoYear')), int(match.group('isoMonth')), int(match.group('isoDay'))
+    elif match.group('year'):
+        first, second, year = int(match.group('first')), int(match.group('second')), int(match.group('year'))
+        # Month first, unless the first number can't be a month
+        month, day = (first, second) if first <= 12 else (second, first)
+    else:
+        year, month, day = int(match.group('monthYear')), MONTHS[match.group('monthName').lower()], int(match.group('day'))
+        suffix = match.group('suffix')
+        if suffix and suffix.lower() != {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10 if day not in (11, 12, 13) else 0, 'th'):
+            return None
     try:
-        body = json.dumps(req.get_json())
+        return datetime.date(year, month, day).isoformat()
     except ValueError:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-    
-    if body:
-        result = compose_response(body)
-        return func.HttpResponse(result, mimetype="application/json")
-    else:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-
-
-def compose_response(json_data):
-    values = json.loads(json_data)['values']
-    
-    # Prepare the Output before the loop
-    results = {}
-    results["values"] = []
-    
-    for value in values:
-        outputRecord = transform_value(value)
-        if outputRecord != None:
-            results["values"].append(outputRecord)
-    # Keeping the original accentuation with ensure_ascii=False
-    return json.dumps(results, ensure_ascii=False)
+        # Not a valid date, 31/02/2019: what datefinder does with it is up to datefinder
+        return None
+
+
+# All dates of the text, window by window, with their offsets in the text.
+# Each window starts on the first white space of the last overlap characters of the previous one. A date is only taken
+# from the window where it starts before the overlap of the next one. The next window skips the dates starting inside
+# the ones already taken, it would parse their end again, like "May 2020" of "12 May 2020".
+def scan_dates(text, window, overlap):
+    start = 0
+    owned = 0
+    while start < len(text):
+        end = len(text)
+        if end - start > window:
+            end = text.rfind(' ', start + 1, start + window + 1)
+            if end <= start + overlap:
+                # No white space, a hard cut
+                end = start + window
+        nextStart = len(text)
+        if end < len(text):
+            nextStart = text.find(' ', end - overlap, end)
+            if nextStart <= start:
+                nextStart = end - overlap
+        ownedEnd = nextStart
+        for match, indices in datefinder.find_dates(text[start:end], index=True):
+            # datefinder may include the white space before the date, the offset is its first character
+            span = text[start + indices[0]:start + indices[1]]
+            offset = start + indices[0] + len(span) - len(span.lstrip())
+            if owned <= offset < nextStart:
+                yield match, offset
+                ownedEnd = max(ownedEnd, start + indices[1])
+        owned = ownedEnd
+        start = nextStart
+
+
+# All distinct dates of the text, as YYYY-MM-DD, and the offsets of their first occurrence in the text.
+# One pass: only the distinct dates are kept, and no window is parsed after the limit.
+def find_all_dates(text, limit, window=WINDOW, overlap=WINDOW_OVERLAP):
+    warm_up()
+    seen = set()
+
+    def distinct():
+        for match, offset in scan_dates(text, window, overlap):
+            # Removing time!!! Change the code if you want it.
+            myDateString = str(match)[0:10]
+            if myDateString not in seen:
+                seen.add(myDateString)
+                yield myDateString, offset
+
+    found = list(itertools.islice(distinct(), limit if limit > 0 else None))
+    return [myDateString for myDateString, _ in found], [offset for _, offset in found]
+
+
+def compose_response(body):
+    # The records loop is in shared_code/skill_base.py, calling transform_value for each record
+    # shared_code/skill_io.py serializes the output keeping the original accentuation
+    return skill_base.compose_response(body, transform_value)
 
 ## Perform an operation on a record
 def transform_value(value):
@@ -84,14 +193,31 @@ def transform_value(value):
         myString=str(myString)
         if len(myString) == 0:
             myString = ' '
-        matches = datefinder.find_dates(myString)
 
-        #First Date only!!!! Change the code if you want all of them.
-        for match in matches:
-          myDate = match
-          # Convert to string
-          myDateString = str(myDate)
-          break
+        # All dates, when you need them
+        # The offsets are in the text as a string: with a list as input, in its str() like "['November 15th 1895']"
+        if ALL_DATES:
+            myDates, myOffsets = find_all_dates(myString, LIMIT)
+            return ({
+                    "recordId": recordId,
+                    "data": {
+                        "text": myDates,
+                        "offsets": myOffsets
+                            }
+                    })
+
+        # The fast path first, datefinder when it finds nothing
+        myDateString = find_first_date(myString)
+        if myDateString is None:
+          warm_up()
+          matches = datefinder.find_dates(myString)
+
+          #First Date only!!!! Change the code if you want all of them.
+          for match in matches:
+            myDate = match
+            # Convert to string
+            myDateString = str(myDate)
+            break
 
         # Removing time!!! Change the code if you want it.
         if len(myDateString) > 1:
@@ -112,35 +238,3 @@ def transform_value(value):
                 "text": myDateString
                     }
             })
-
-
-# Testing the function
-
-myInput = {
-    "values": [
-      {
-        "recordId": "0",
-        "data":
-           {
-            "text": ["Flamengo was founded on November 15th 1895"]
-           }
-      } ,
-        {
-        "recordId": "1",
-        "data":
-           {
-            "text": [""]
-           }
-      } ,    
-      {
-        "recordId": "2",
-        "data":
-           {
-            "text": ["Flamengo campeão de tudo em 2019!"]
-           }
-      } 
-    ]
-}
-
-inputTest = json.dumps(myInput)
-compose_response (inputTest)
@@ -0,0 +1,3 @@
+# Shared code for the skills of this toolkit.
+# - Deploy this folder at the root of your Function App, side by side with the skills folders.
+# - The skills import it with "from shared_code import <module>".
@@ -0,0 +1,89 @@
+# Shared code for the skills calling remote APIs: hedged requests, to cut the tail latency.
+# - The latencies of the last requests are kept. When a request takes longer than the chosen percentile of them,
+#   a duplicate request is sent and the first response wins. The slower one is ignored when it completes.
+# - There is no hedging before minSamples latencies are known.
+# - maxExtra caps the extra load: the number of duplicates is at most maxExtra times the number of requests.
+#   With maxExtra=0.05 the API receives at most 5% more requests.
+# - A request that fails before the delay is not hedged, it is an error, not a slow request.
+# - Only use it for idempotent requests, like GET lookups: both requests may be executed by the API.
+# - stats() returns requests, hedges fired, hedges won (the duplicate was faster), hedges skipped (above maxExtra),
+#   and the current delay in milliseconds.
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+
+class Hedger:
+
+    def __init__(self, name, percentile=95.0, maxExtra=0.05, maxWorkers=16, minSamples=20, window=500):
+        self.percentile = percentile
+        self.maxExtra = maxExtra
+        self.minSamples = minSamples
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers,
+                                                               thread_name_prefix=name + '-hedging')
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._requests = 0
+        self._fired = 0
+        self._won = 0
+        self._skipped = 0
+
+    def _delay(self):
+        # Seconds before the duplicate request, None while there are not enough latencies
+        if len(self._latencies) < self.minSamples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))]
+
+    def _timed(self, function):
+        start = time.monotonic()
+        result = function()
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def call(self, function):
+        # Returns the result of function(), from the first request that completes
+        with self._lock:
+            self._requests += 1
+            delay = self._delay()
+        primary = self._executor.submit(self._timed, function)
+        if delay is None:
+            return primary.result()
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        with self._lock:
+            hedge = self._fired < self.maxExtra * self._requests
+            if hedge:
+                self._fired += 1
+            else:
+                self._skipped += 1
+        if not hedge:
+            return primary.result()
+
+        duplicate = self._executor.submit(self._timed, function)
+        pending = [primary, duplicate]
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in pending[:]:
+                if future not in done:
+                    continue
+                if future.exception() is None:
+                    if future is duplicate:
+                        with self._lock:
+                            self._won += 1
+                    return future.result()
+                pending.remove(future)
+        # Both failed, the error of the first request is raised
+        return primary.result()
+
+    def stats(self):
+        with self._lock:
+            delay = self._delay()
+            return {'requests': self._requests, 'fired': self._fired, 'won': self._won, 'skipped': self._skipped,
+                    'delay ms': None if delay is None else round(delay * 1000, 1)}
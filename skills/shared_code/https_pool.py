@@ -0,0 +1,86 @@
+# Shared code for the skills calling HTTPS APIs.
+# - A pool of persistent keep-alive HTTPS connections to one host, created once per process as a global variable.
+#   The connections are reused across records and across invocations: TCP and TLS setup are paid once per
+#   connection, not once per request.
+# - At most "size" connections exist at the same time. Extra requests wait for a free connection.
+# - A reused connection may have been closed by the server. In this case the connection is opened again and the
+#   request is sent once more, on a new connection. Other errors are raised to the caller.
+# - stats() returns the number of requests, of connections opened (TLS handshakes), and of reconnects.
+
+import collections
+import http.client
+import ssl
+import threading
+
+Response = collections.namedtuple('Response', ['status', 'headers', 'data'])
+
+
+class HTTPSPool:
+
+    def __init__(self, host, size=8, timeout=10.0):
+        self.host = host
+        self.size = size
+        self.timeout = timeout
+        # One SSL context for all connections, it also allows TLS session reuse
+        self._context = ssl.create_default_context()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._requests = 0
+        self._handshakes = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        with self._lock:
+            self._handshakes += 1
+        return http.client.HTTPSConnection(self.host, timeout=self.timeout, context=self._context)
+
+    def request(self, method, url, body=None, headers=None):
+        # Returns a Response with the status, the headers and the body (bytes) of the response
+        with self._slots:
+            with self._lock:
+                self._requests += 1
+                conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect()
+            try:
+                try:
+                    response, willClose = self._send(conn, method, url, body, headers)
+                except (http.client.HTTPException, ConnectionError, ssl.SSLEOFError):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # The server closed the keep-alive connection, trying once more on a new one
+                    with self._lock:
+                        self._reconnects += 1
+                    conn = self._connect()
+                    response, willClose = self._send(conn, method, url, body, headers)
+            except Exception:
+                conn.close()
+                raise
+            if willClose:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+            return response
+
+    @staticmethod
+    def _send(conn, method, url, body, headers):
+        conn.request(method, url, body, headers or {})
+        response = conn.getresponse()
+        # The body must be read before the connection is used again
+        data = response.read()
+        return Response(response.status, response.headers, data), response.will_close
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self._requests, 'handshakes': self._handshakes, 'reconnects': self._reconnects,
+                    'idle': len(self._idle)}
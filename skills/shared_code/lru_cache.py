@@ -0,0 +1,57 @@
+# Shared code for all skills: a bounded in-memory cache, as a global variable of the skill.
+# - Least recently used entries are evicted when the cache is full (maxSize entries).
+# - Entries older than ttl seconds are expired. Use ttl=None for entries that never expire.
+# - Safe for concurrent invocations in the same process.
+# - stats() returns hits, misses, evictions (full cache), expirations (ttl), and size. Use them to tune maxSize.
+# - get() returns MISSING when the key is not in the cache, because None may be a cached value.
+
+import collections
+import threading
+import time
+
+MISSING = object()
+
+
+class LRUCache:
+
+    def __init__(self, maxSize=10000, ttl=None):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if self.maxSize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'evictions': self._evictions,
+                    'expirations': self._expirations, 'size': len(self._entries)}
@@ -0,0 +1,95 @@
+# Shared code for the skills detecting PII: a local pre-screen, before calling a remote API.
+# - Precompiled regular expressions for the obvious cases: email addresses, phone numbers, and US social security
+#   numbers. They only match confident hits, with separators, so a year or an amount is never taken as PII.
+# - A hit means the text has PII. No hit doesn't mean anything: the text still needs the remote API.
+# - The patterns are English/US formats, like the Content Moderator API with language=eng. Add yours to PATTERNS, an
+#   object with a search(text) method, like a compiled regular expression.
+# - NOT_PII are texts that must not match any pattern, and PII the ones that must. Check them after changing PATTERNS:
+#       python -m shared_code.samples --pii-patterns
+# - stats() returns how many texts were checked, the remote calls avoided (texts with a hit), and the hits of each
+#   pattern.
+
+import re
+import threading
+
+
+class DigitCount:
+
+    # A regular expression whose matches must have between minimum and maximum digits
+    def __init__(self, pattern, minimum, maximum):
+        self.pattern = pattern
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def search(self, text):
+        for match in self.pattern.finditer(text):
+            if self.minimum <= sum(character.isdigit() for character in match.group()) <= self.maximum:
+                return match
+        return None
+
+
+PATTERNS = {
+    'email': re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}'),
+    # 206-999-1981, (206) 999-1981, 206.999.1981, +1 206 999 1981. Only spaces between the groups, like a row of
+    # numbers, is a phone number with the area code in parentheses or the +1 prefix.
+    'phone': re.compile(r'(?<![\w+-])(?:\+1[ .-]?(?:\(\d{3}\) ?|\d{3}[ .-])\d{3}[ .-]\d{4}'
+                        r'|(?:1[ .-]?)?\(\d{3}\) ?\d{3}[ .-]\d{4}'
+                        r'|(?:1[.-])?\d{3}([.-])\d{3}\1\d{4})(?![\w-])'),
+    # +44 20 7946 0958, +55 21 99999-1981. Groups of at least 2 digits, 8 to 15 digits, not a version or an amount.
+    'international phone': DigitCount(
+        re.compile(r'(?<![\w+])\+\d{1,3}(?:[ .-]\(?\d{2,5}\)?){2,4}(?![\w-])'), 8, 15),
+    # 078-05-1120, not the invalid 000, 666 and 9xx areas
+    'ssn': re.compile(r'(?<![\w-])(?!000|666|9)\d{3}-(?!00)\d{2}-(?!0000)\d{4}(?![\w-])'),
+}
+
+PII = [
+    'Call 206-999-1981 now',
+    'Call (206) 999-1981 now',
+    'Call (206) 999 1981 now',
+    'Call 206.999.1981 now',
+    'Call +1 206 999 1981 now',
+    'Call 1-206-999-1981 now',
+    'London office +44 20 7946 0958',
+    'Rio office +55 21 99999-1981',
+    'Write to contato@flamengo.com',
+    'SSN 078-05-1120',
+]
+
+NOT_PII = [
+    'Version +1.2.3 released',
+    'Revenue grew +1.5 2.5 percent',
+    'Temp +5 10 20',
+    'Table: 100 200 3000 units',
+    'pages 123 456 7890',
+    'Flamengo was founded in 1895 and won 2019-11-23',
+    'The budget was 1,500,000.00 in 2019',
+    'Order 206-999-19811 shipped',
+    'Invalid SSN 000-12-3456',
+]
+
+
+class PIIPreScreen:
+
+    def __init__(self, patterns=None):
+        self.patterns = PATTERNS if patterns is None else patterns
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._hits = dict.fromkeys(self.patterns, 0)
+
+    def match(self, text):
+        # Returns the name of the first pattern found in the text, None when there is no confident hit
+        found = None
+        for name, pattern in self.patterns.items():
+            if pattern.search(text):
+                found = name
+                break
+        with self._lock:
+            self._checked += 1
+            if found is not None:
+                self._hits[found] += 1
+        return found
+
+    def stats(self):
+        with self._lock:
+            return {'checked': self._checked, 'api calls avoided': sum(self._hits.values()),
+                    'patterns': dict(self._hits)}
@@ -0,0 +1,173 @@
+# Shared code for the skills calling APIs with a quota, like transactions per second (TPS) or request units (RU/s).
+# - TokenBucket paces the requests of all records and invocations of the process to "rate" requests per second,
+#   with bursts of at most "burst" requests. Use one global variable per API key.
+# - RateLimiter sends a request when the bucket allows it. A throttled response (HTTP 429) is retried with a jittered
+#   exponential backoff. The Retry-After header of the response is respected when there is one, and the bucket is
+#   paused as well, so the other records don't hit the quota at the same time.
+# - After maxRetries the throttled response is returned, the caller decides what to do with it.
+# - The quota is per API key, and each process has its own bucket: divide the TPS by the number of processes.
+# - stats() returns requests, throttled responses, retries, and the seconds spent waiting.
+# - AdaptiveLimit bounds the requests in flight, for APIs with a quota that isn't per request, like the RU/s of
+#   Cosmos DB. The limit is halved after a throttled response and grows by one after "limit" successful requests.
+#   Its stats() returns the current limit, the requests in flight, and the throttled responses.
+
+import email.utils
+import random
+import threading
+import time
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        # rate <= 0 disables the pacing
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        # Takes the tokens, waiting for them when the bucket is empty. Returns the seconds waited.
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # The tokens are reserved now, the callers are served in order
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        # No token for the next "seconds", after a throttled response. A deadline: the pauses of concurrent throttled
+        # responses don't add up, N responses with the same Retry-After cost one Retry-After.
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def waited(self):
+        with self._lock:
+            return self._waited
+
+
+def retry_after(headers):
+    # Seconds from a Retry-After header, a number of seconds or an HTTP date. None without the header.
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+
+    def __init__(self, rate, burst=None, maxRetries=5, baseDelay=0.5, maxDelay=30.0, statuses=(429,)):
+        self.bucket = TokenBucket(rate, burst)
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.statuses = statuses
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._throttled = 0
+        self._retries = 0
+        self._backoff = 0.0
+
+    def request(self, function):
+        # function() sends the request and returns a response with status and headers, like https_pool.Response
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            response = function()
+            with self._lock:
+                self._requests += 1
+                if response.status in self.statuses:
+                    self._throttled += 1
+            if response.status not in self.statuses or attempt >= self.maxRetries:
+                return response
+
+            # Full jitter: a random delay up to the exponential backoff, at least the Retry-After of the API
+            delay = random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+            after = retry_after(response.headers)
+            if after is not None:
+                delay = min(self.maxDelay, after) + delay / 4
+            with self._lock:
+                self._retries += 1
+            if self.bucket.rate > 0:
+                # The next acquire() waits for the delay, like all other records
+                self.bucket.pause(delay)
+            else:
+                with self._lock:
+                    self._backoff += delay
+                time.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self._requests, 'throttled': self._throttled, 'retries': self._retries,
+                    'waited s': round(self.bucket.waited() + self._backoff, 2)}
+
+
+class AdaptiveLimit:
+
+    def __init__(self, maximum, minimum=1, cooldown=1.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        # Throttled responses of the requests already in flight don't decrease the limit again
+        self.cooldown = cooldown
+        self.limit = maximum
+        self._condition = threading.Condition()
+        self._inFlight = 0
+        self._successes = 0
+        self._throttled = 0
+        self._decreased = 0.0
+
+    def __enter__(self):
+        with self._condition:
+            while self._inFlight >= self.limit:
+                self._condition.wait()
+            self._inFlight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self._inFlight -= 1
+            self._condition.notify()
+
+    def succeeded(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+    def throttled(self):
+        with self._condition:
+            self._throttled += 1
+            self._successes = 0
+            now = time.monotonic()
+            if now - self._decreased >= self.cooldown:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._decreased = now
+
+    def stats(self):
+        with self._condition:
+            return {'limit': self.limit, 'in flight': self._inFlight, 'throttled': self._throttled}
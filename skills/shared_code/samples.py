@@ -0,0 +1,248 @@
+# Shared code for all skills: sample inputs, sample runner and cold start report.
+# - The samples used to be at the end of each __init__.py file and ran at import time, on every cold start.
+#   For cosmosdb-writer and bing-search that meant a database connection and an API call before the first request.
+# - Run the samples of all skills, or of some of them, from the skills folder:
+#       python -m shared_code.samples
+#       python -m shared_code.samples csv-lookup dates-extractor
+# - Cold start report. Each skill is imported in a new Python process, then its warm_up() hook is called.
+#   Skills above the import time budget, in milliseconds, are reported and the exit code is 1:
+#       python -m shared_code.samples --cold-start --budget-ms 300
+# - Regression check of the dates-extractor fast path: the texts of DATES_REGRESSION, and your own text files with one
+#   text per line, must give the same first date with the fast path and with datefinder. The all dates mode, reading
+#   the text in windows, must give the same dates and offsets as datefinder with the whole text. The exit code is 1
+#   otherwise:
+#       python -m shared_code.samples --dates-regression
+#       python -m shared_code.samples --dates-regression my-corpus.txt
+# - Check of the content-moderator PII pre-screen patterns, with the PII and NOT_PII texts of shared_code/pii_patterns.py.
+#   The exit code is 1 when a text is not matched as expected:
+#       python -m shared_code.samples --pii-patterns
+# - Remember: bing-search, content-moderator, and cosmosdb-writer samples call Azure services.
+#   Add your keys to the skills code before running them.
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+SKILLS_FOLDER = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+SAMPLES = {
+    "bing-search": {
+        "values": [
+            {"recordId": "0", "data": {"text": "Flamengo"}}
+        ]
+    },
+    "content-moderator": {
+        "values": [
+            {"recordId": "0", "data": {"text": ["Flamengo phone numer is 206-999-1981. The email address is contato@flamengo.com ."]}},
+            {"recordId": "1", "data": {"text": ["Flamengo is the new champion!!"]}},
+            {"recordId": "2", "data": {"text": []}}
+        ]
+    },
+    "cosmosdb-writer": {
+        "values": [
+            {"recordId": "0", "data": {"text": ["FLAMENGO", "VASCO", "FLAMENGO", "FLUMINENSE", "FLAMENGO"]}},
+            {"recordId": "1", "data": {"text": [""]}},
+            {"recordId": "2", "data": {"text": ["FLAMENGO", "Flamengo", "flamengo", "FLAMENGO"]}}
+        ]
+    },
+    # Third record is an empty string. It will work.
+    # The sample csv content is: FLAMENGO, BARCELONA, REAL MADRID, MANCHESTER UNITED, LIVERPOOL, MILAN, JUVENTUS
+    "csv-filter": {
+        "values": [
+            {"recordId": "0", "data": {"text": "FLAMENGO is the new champion"}},
+            {"recordId": "1", "data": {"text": "FLAMENGO beat LIVERPOOL in the 1981 World Cup final."}},
+            {"recordId": "2", "data": {"text": ""}}
+        ]
+    },
+    "csv-lookup": {
+        "values": [
+            {"recordId": "0", "data": {"text": "Flamengo is the new champion"}},
+            {"recordId": "1", "data": {"text": "Flamengo beat Liverpool in the 1981 World Cup final."}},
+            {"recordId": "2", "data": {"text": ""}}
+        ]
+    },
+    "dates-extractor": {
+        "values": [
+            {"recordId": "0", "data": {"text": ["Flamengo was founded on November 15th 1895"]}},
+            {"recordId": "1", "data": {"text": [""]}},
+            {"recordId": "2", "data": {"text": ["Flamengo campeão de tudo em 2019!"]}}
+        ]
+    },
+    "strings-cleaner": {
+        "values": [
+            {"recordId": "0", "data": {"text": ["Flamengo Campeão!!!!###"]}},
+            {"recordId": "1", "data": {"text": [""]}},
+            {"recordId": "2", "data": {"text": ["Nação Rubro Negra"]}}
+        ]
+    },
+    "strings-distinct": {
+        "values": [
+            {"recordId": "0", "data": {"text": ["FLAMENGO", "VASCO", "FLAMENGO", "FLUMINENSE", "FLAMENGO"]}},
+            {"recordId": "1", "data": {"text": [""]}},
+            {"recordId": "2", "data": {"text": ["FLAMENGO", "Flamengo", "flamengo", "FLAMENGO"]}}
+        ]
+    },
+    # Forcing one error for the second record. Third record is an empty string. It will work.
+    "strings-merger": {
+        "values": [
+            {"recordId": "0", "data": {"string1": "Flamengo is", "string2": "the new champion"}},
+            {"recordId": "1", "data": {"string1": "Flamengo_Libertadores_2019.jpg"}},
+            {"recordId": "2", "data": {"string1": "Flamengo_Libertadores_2019.jpg", "string2": ""}}
+        ]
+    },
+}
+
+# Runs in a new process: import time and warm_up() time, in milliseconds
+COLD_START_CODE = """
+import importlib, json, sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+skill = importlib.import_module(%r)
+imported = time.perf_counter()
+if hasattr(skill, 'warm_up'):
+    skill.warm_up()
+print(json.dumps([(imported - start) * 1000, (time.perf_counter() - imported) * 1000]))
+"""
+
+# The first date of these texts is the same with the dates-extractor fast path and with datefinder
+DATES_REGRESSION = [
+    "['Flamengo was founded on November 15th 1895']",
+    "['Flamengo campeão de tudo em 2019!']",
+    "The final was played on 2019-11-23 in Lima.",
+    "The final was played on 23/11/2019 in Lima.",
+    "Published 05/11/2019, the report was updated later.",
+    "Report of 12/31/1999: the club celebrated.",
+    "Flamengo beat Liverpool on December 13th 1981, in Tokyo.",
+    "Flamengo beat Liverpool on Dec 13 1981 in Tokyo.",
+    "Final: March 3rd, 2021!",
+    "Invalid: 31/02/2019 is not a date, 2019-11-23 is.",
+    "Leap day 2020-02-29 and not 2019-02-29.",
+    "Kick off 2019-11-23T17:00:00 at the stadium.",
+    "Flamengo won the Libertadores on Saturday, November 23rd 2019.",
+    "Flamengo won the Libertadores until 2019-11-23 at 5 pm.",
+    "The club money on 2019-11-23 was enough.",
+    # A date across the edge of the first window of the all dates mode, 4096 characters with the default settings
+    "wwww " + "word " * 805 + "12 May 2020 was the day " + "b " * 100,
+]
+
+# Small windows for the all dates mode check, so the dates of short texts are across the edges of the windows too.
+# The overlap is longer than the longest date of the texts, like "Saturday, November 23rd 2019".
+DATES_WINDOWS = [(80, 40)]
+
+
+def dates_regression(texts):
+    # Returns the texts with a different first date, or different dates in the all dates mode.
+    # Texts not handled by the fast path use datefinder, their first date is not checked.
+    if SKILLS_FOLDER not in sys.path:
+        sys.path.insert(0, SKILLS_FOLDER)
+    skill = importlib.import_module('dates-extractor')
+    skill.warm_up()
+    different = []
+    fast = 0
+    for text in texts:
+        expected = ''
+        for match in skill.datefinder.find_dates(text):
+            expected = str(match)[0:10]
+            break
+        myDateString = skill.find_first_date(text)
+        if myDateString is not None:
+            fast += 1
+            if myDateString != expected:
+                print('DIFFERENT  fast path %s  datefinder %s  %r' % (myDateString, expected or '-', text))
+                different.append(text)
+                continue
+
+        # All dates of the whole text, with the offset of their first character
+        expectedDates = []
+        expectedOffsets = []
+        for match, indices in skill.datefinder.find_dates(text, index=True):
+            span = text[indices[0]:indices[1]]
+            if str(match)[0:10] not in expectedDates:
+                expectedDates.append(str(match)[0:10])
+                expectedOffsets.append(indices[0] + len(span) - len(span.lstrip()))
+        for window, overlap in [(skill.WINDOW, skill.WINDOW_OVERLAP)] + DATES_WINDOWS:
+            myDates, myOffsets = skill.find_all_dates(text, 0, window, overlap)
+            if (myDates, myOffsets) != (expectedDates, expectedOffsets):
+                print('DIFFERENT  all dates, window %d  %s  datefinder %s  %r' % (window, list(zip(myDates, myOffsets)),
+                      list(zip(expectedDates, expectedOffsets)), text[:200]))
+                different.append(text)
+                break
+    print('%d texts, %d with the fast path, %d different' % (len(texts), fast, len(different)))
+    return different
+
+
+def pii_patterns_check():
+    # Returns the texts of PII without a hit, and the texts of NOT_PII with a hit
+    from shared_code import pii_patterns
+    preScreen = pii_patterns.PIIPreScreen()
+    wrong = []
+    for text, expected in [(text, True) for text in pii_patterns.PII] + [(text, False) for text in pii_patterns.NOT_PII]:
+        found = preScreen.match(text)
+        if (found is not None) != expected:
+            print('WRONG  %s  %r' % (found or 'no hit', text))
+            wrong.append(text)
+    print('%d texts, %d wrong' % (len(pii_patterns.PII) + len(pii_patterns.NOT_PII), len(wrong)))
+    return wrong
+
+
+def run_sample(skill):
+    if SKILLS_FOLDER not in sys.path:
+        sys.path.insert(0, SKILLS_FOLDER)
+    module = importlib.import_module(skill)
+    return module.compose_response(SAMPLES[skill])
+
+
+def cold_start(skill):
+    # Returns (import ms, warm up ms), or raises RuntimeError with the error of the new process
+    process = subprocess.run([sys.executable, '-c', COLD_START_CODE % (SKILLS_FOLDER, skill)],
+                             capture_output=True, text=True, cwd=SKILLS_FOLDER)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return tuple(json.loads(process.stdout.strip().splitlines()[-1]))
+
+
+def cold_start_report(skills, budgetMs):
+    overBudget = []
+    print('%-20s %12s %12s  %s' % ('skill', 'import ms', 'warm_up ms', 'status'))
+    for skill in skills:
+        try:
+            importMs, warmUpMs = cold_start(skill)
+        except RuntimeError as error:
+            print('%-20s %12s %12s  %s' % (skill, '-', '-', 'ERROR ' + str(error)))
+            overBudget.append(skill)
+            continue
+        status = 'OK' if importMs <= budgetMs else 'OVER BUDGET'
+        if importMs > budgetMs:
+            overBudget.append(skill)
+        print('%-20s %12.1f %12.1f  %s' % (skill, importMs, warmUpMs, status))
+    return overBudget
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the skills samples, or the cold start report.')
+    parser.add_argument('skills', nargs='*', default=sorted(SAMPLES))
+    parser.add_argument('--cold-start', action='store_true', help='cold start report instead of the samples')
+    parser.add_argument('--budget-ms', type=float, default=300.0, help='import time budget per skill')
+    parser.add_argument('--dates-regression', nargs='*', metavar='FILE',
+                        help='dates-extractor fast path regression check, with the texts of the files, one per line')
+    parser.add_argument('--pii-patterns', action='store_true', help='content-moderator PII pre-screen patterns check')
+    arguments = parser.parse_args()
+
+    if arguments.dates_regression is not None:
+        texts = list(DATES_REGRESSION)
+        for fileName in arguments.dates_regression:
+            with open(fileName, encoding='utf-8') as corpus:
+                texts.extend(line.rstrip('\n') for line in corpus if line.strip())
+        sys.exit(1 if dates_regression(texts) else 0)
+
+    if arguments.pii_patterns:
+        sys.exit(1 if pii_patterns_check() else 0)
+
+    if arguments.cold_start:
+        sys.exit(1 if cold_start_report(arguments.skills, arguments.budget_ms) else 0)
+    for skill in arguments.skills:
+        print('=== ' + skill)
+        print(json.dumps(run_sample(skill), ensure_ascii=False, indent=4))
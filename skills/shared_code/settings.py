@@ -0,0 +1,16 @@
+# Shared code for all skills: configuration from the Function App application settings.
+# - Application settings are environment variables for the Python worker. Locally, use local.settings.json.
+# - The default is returned when the setting doesn't exist or is empty. It also defines the type of the value.
+
+import os
+
+
+def get(name, default=None):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if default is None:
+        return value
+    return type(default)(value)
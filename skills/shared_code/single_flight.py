@@ -0,0 +1,55 @@
+# Shared code for all skills: single flight, or request coalescing, for concurrent invocations in the same process.
+# - The first caller for a key runs the function. Concurrent callers for the same key wait for it and share its
+#   result, or its exception. A thundering herd of duplicate lookups becomes one single request.
+# - Nothing is kept after the function returns. Use a cache for that.
+# - stats() returns how many times the function was executed and how many callers shared a result.
+
+import threading
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._shared = 0
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+            else:
+                self._shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {'executed': self._executed, 'shared': self._shared, 'in flight': len(self._calls)}
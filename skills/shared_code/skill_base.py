@@ -0,0 +1,87 @@
+# Shared code for all skills: the records loop of compose_response.
+# - transform_value(value) is called for each record, as always. That's the default.
+# - A skill can also have transform_batch(values). It receives the whole values array and returns one output
+#   record (or None) per value, in the same order. Regex scans, automaton passes, API calls, and database writes
+#   can then be done once per batch, not once per record. Errors are still reported per record.
+# - If transform_batch fails, or returns something else, the batch falls back to transform_value, record by record.
+# - transform_concurrently() is a ready transform_batch for skills waiting on remote APIs. The records of the batch
+#   are processed by a bounded thread pool, one pool per skill and per process, so the number of requests in flight
+#   never goes above the pool size, even with concurrent invocations. The order of the values is preserved.
+
+import concurrent.futures
+import logging
+import threading
+
+ERROR_MESSAGE = "Could not complete operation for record."
+
+
+def compose_response(body, transform_value, transform_batch=None):
+    values = body['values']
+
+    # Prepare the Output before the loop
+    results = {}
+    results["values"] = []
+
+    outputRecords = None
+    if transform_batch is not None:
+        try:
+            outputRecords = transform_batch(values)
+        except Exception:
+            logging.exception('transform_batch failed, processing record by record.')
+        if outputRecords is not None and len(outputRecords) != len(values):
+            logging.error('transform_batch returned %d records for %d values, processing record by record.',
+                          len(outputRecords), len(values))
+            outputRecords = None
+    if outputRecords is None:
+        outputRecords = [transform_value(value) for value in values]
+
+    for outputRecord in outputRecords:
+        if outputRecord != None:
+            results["values"].append(outputRecord)
+    return results
+
+
+def validate(value, fields=('text',)):
+    # The inputs validation of the skills, for transform_batch. Returns None or the error record.
+    recordId = value['recordId']
+    try:
+        assert ('data' in value), "'data' field is required."
+        data = value['data']
+        for field in fields:
+            assert (field in data), "'%s' field is required in 'data' object." % field
+    except AssertionError as error:
+        return (
+            {
+            "recordId": recordId,
+            "data":{},
+            "errors": [ { "message": "Error:" + error.args[0] }   ]
+            })
+    return None
+
+
+def error_record(recordId, message=ERROR_MESSAGE):
+    return (
+        {
+        "recordId": recordId,
+        "errors": [ { "message": message }   ]
+        })
+
+
+_executors = {}
+_executorsLock = threading.Lock()
+
+
+def executor(name, maxWorkers):
+    # The thread pool of a skill, created once per process
+    with _executorsLock:
+        if name not in _executors:
+            _executors[name] = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers,
+                                                                     thread_name_prefix=name)
+        return _executors[name]
+
+
+def transform_concurrently(name, values, transform_value, maxInFlight):
+    # Runs transform_value for all values, at most maxInFlight at the same time. Same order of the values.
+    if maxInFlight <= 1 or len(values) <= 1:
+        return [transform_value(value) for value in values]
+    return list(executor(name, maxInFlight).map(transform_value, values))
@@ -0,0 +1,65 @@
+# Shared code for all skills: the request and response layer.
+# - The request body is parsed only once, straight from the bytes of req.get_body().
+#   No more req.get_json() followed by json.dumps() and json.loads() again in compose_response.
+# - The response is serialized in one single step, keeping the original accents (ensure_ascii=False).
+# - If orjson is installed it is used for both, it is much faster. Add it to your requirements.txt file if you want it.
+#   Without orjson, the standard json library is used. orjson is stricter, the standard json library is used instead:
+#   1) For bodies orjson rejects, like NaN or Infinity values, accepted by req.get_json().
+#   2) For bodies with 19 digits or more in a row: orjson turns integers wider than 64 bits into floats.
+#   3) For results orjson can't serialize, like integers wider than 64 bits.
+#   The only difference left: NaN and Infinity are serialized as null by orjson, and as NaN and Infinity by json.
+
+import json
+import re
+import azure.functions as func
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Maybe an integer wider than 64 bits, or just a long number in a string
+WIDE_INTEGER = re.compile(r'\d{19}')
+WIDE_INTEGER_BYTES = re.compile(rb'\d{19}')
+
+
+def loads(body):
+    # Bytes or string to Python objects. Raises ValueError for invalid JSON.
+    if orjson is not None:
+        wideInteger = WIDE_INTEGER if isinstance(body, str) else WIDE_INTEGER_BYTES
+        if not wideInteger.search(body):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(body)
+
+
+def dumps(results):
+    # Python objects to utf-8 bytes, keeping the original accentuation
+    if orjson is not None:
+        try:
+            return orjson.dumps(results)
+        except TypeError:
+            pass
+    return json.dumps(results, ensure_ascii=False).encode('utf-8')
+
+
+def handle_request(req, compose_response):
+    # The main() of all skills: compose_response receives the parsed body and returns the results dictionary
+    try:
+        body = loads(req.get_body())
+    except ValueError:
+        return func.HttpResponse(
+             "Invalid body",
+             status_code=400
+        )
+
+    if body:
+        result = compose_response(body)
+        return func.HttpResponse(dumps(result), mimetype="application/json")
+    else:
+        return func.HttpResponse(
+             "Invalid body",
+             status_code=400
+        )
@@ -0,0 +1,88 @@
+# Shared code for all skills: a persistent cache in a local SQLite file, that survives cold starts and recycles.
+# - The file uses WAL mode: the worker processes of the same instance can read it while one of them writes.
+#   Use a local disk path. SQLite files on network shares, like Azure Files, are slow and not safe.
+# - Entries older than ttl seconds are ignored, and deleted on the next flush. Use ttl=None to keep them forever.
+# - put() only keeps the entry in memory. flush() writes all entries in one transaction, call it once per invocation.
+# - Values are stored as JSON.
+# - A problem with the file is logged and handled as a cache miss. The skill keeps working without the cache.
+# - stats() returns hits, misses, writes, and errors.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from shared_code import lru_cache
+
+MISSING = lru_cache.MISSING
+
+
+class SQLiteCache:
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pending = {}
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._errors = 0
+
+    def _connect(self):
+        # Opened by the first request, not at cold start
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL)')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pending:
+                self._hits += 1
+                return self._pending[key]
+            try:
+                row = self._connect().execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error:
+                logging.warning('Persistent cache %s is not available.', self.path, exc_info=True)
+                self._errors += 1
+                row = None
+            if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+                self._misses += 1
+                return MISSING
+            self._hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._lock:
+            self._pending[key] = value
+
+    def flush(self):
+        # Writes the pending entries in one transaction, and deletes the expired ones
+        with self._lock:
+            if not self._pending:
+                return
+            now = time.time()
+            rows = [(key, json.dumps(value), now) for key, value in self._pending.items()]
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)',
+                                           rows)
+                    if self.ttl is not None:
+                        connection.execute('DELETE FROM cache WHERE created < ?', (now - self.ttl,))
+                self._writes += len(rows)
+            except sqlite3.Error:
+                logging.warning('Persistent cache %s is not available.', self.path, exc_info=True)
+                self._errors += 1
+            self._pending = {}
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'writes': self._writes, 'errors': self._errors,
+                    'pending': len(self._pending)}
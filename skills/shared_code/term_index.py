@@ -0,0 +1,146 @@
+# Shared code for the csv-lookup and csv-filter skills.
+# - Compiles terms.csv into terms.idx, a compact binary index file. Run it offline, before the deployment:
+#       cd skills
+#       python -m shared_code.term_index csv-lookup/terms.csv
+# - The skills open terms.idx with mmap, read-only. All worker processes share the same physical pages
+#   and the index is ready in milliseconds, nothing is parsed or built at cold start.
+# - When there is no terms.idx file, the skills read terms.csv as before. See shared_code/terms_cache.py
+# - Rebuild the index every time you change the csv file!
+# - Same matching rules of shared_code/term_matcher.py, the output is the same.
+#
+# File layout, little endian:
+#   header   magic, number of terms, number of entries, max words of a term
+#   hashes   one 64 bits hash per entry, sorted. An entry is a term, or the first words of a term.
+#   indexes  one 32 bits term index per entry, -1 for the first words of a term
+#   offsets  one 64 bits offset per term, plus the end, for the terms text
+#   terms    the terms as they are in the csv file, utf-8
+
+import array
+import bisect
+import csv
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from shared_code import term_matcher
+
+MAGIC = b'SKTIDX01'
+HEADER = struct.Struct('<8sIII4x')
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _padding(size):
+    return b'\0' * (-size % 8)
+
+
+def compile_index(csvFile, indexFile, encoding='latin-1'):
+    with open(csvFile, 'r', encoding=encoding) as csvList:
+        # One term per line, first column only. Empty lines are ignored.
+        terms = [str(term[0]) for term in csv.reader(csvList) if term]
+
+    entries = set()
+    maxWords = 0
+    for index, term in enumerate(terms):
+        words = term.lower().split(' ')
+        maxWords = max(maxWords, len(words))
+        for size in range(1, len(words)):
+            entries.add((hash_key(' '.join(words[:size])), -1))
+        entries.add((hash_key(' '.join(words)), index))
+    entries = sorted(entries)
+
+    hashes = array.array('Q', (entry[0] for entry in entries))
+    indexes = array.array('i', (entry[1] for entry in entries))
+    blobs = [term.encode('utf-8') for term in terms]
+    offsets = array.array('Q', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    if sys.byteorder != 'little':
+        for part in (hashes, indexes, offsets):
+            part.byteswap()
+
+    # Writing to a temporary file first, the skills may be reading the old index
+    tempFile = indexFile + '.tmp'
+    with open(tempFile, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, len(terms), len(entries), maxWords))
+        output.write(hashes.tobytes())
+        output.write(indexes.tobytes())
+        output.write(_padding(len(indexes) * 4))
+        output.write(offsets.tobytes())
+        output.write(b''.join(blobs))
+    os.replace(tempFile, indexFile)
+    return len(terms)
+
+
+class _MappedTerms:
+    # The terms as the csv file has them, decoded only when used
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def raw(self, index):
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __getitem__(self, index):
+        return self.raw(index).strip()
+
+
+class MappedTermIndex(term_matcher.BaseMatcher):
+
+    def __init__(self, indexFile):
+        if sys.byteorder != 'little':
+            raise ValueError('Memory mapped term index requires a little endian platform.')
+        with open(indexFile, 'rb') as input:
+            self._mmap = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, termCount, entryCount, self._maxWords = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('Not a term index file: ' + indexFile)
+        start = HEADER.size
+        self._hashes = view[start:start + entryCount * 8].cast('Q')
+        start += entryCount * 8
+        self._indexes = view[start:start + entryCount * 4].cast('i')
+        start += entryCount * 4 + len(_padding(entryCount * 4))
+        offsets = view[start:start + (termCount + 1) * 8].cast('Q')
+        start += (termCount + 1) * 8
+        self.terms = _MappedTerms(view[start:], offsets)
+
+    def find(self, words):
+        # Yields (first word, last word + 1, term index) for every occurrence, overlapping ones included.
+        # For each word, tries the longer terms while their first words are in the index.
+        hashes = self._hashes
+        indexes = self._indexes
+        entryCount = len(hashes)
+        for first in range(len(words)):
+            key = None
+            for last in range(first, min(len(words), first + self._maxWords)):
+                # None separates texts, see lookup_many()
+                if words[last] is None:
+                    break
+                key = words[last] if key is None else key + ' ' + words[last]
+                keyHash = hash_key(key)
+                entry = bisect.bisect_left(hashes, keyHash)
+                if entry == entryCount or hashes[entry] != keyHash:
+                    break
+                while entry < entryCount and hashes[entry] == keyHash:
+                    index = indexes[entry]
+                    # Checking the text too, different keys may have the same hash
+                    if index >= 0 and self.terms.raw(index).lower() == key:
+                        yield first, last + 1, index
+                    entry += 1
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print('Usage: python -m shared_code.term_index <terms.csv> [<terms.idx>]')
+        sys.exit(1)
+    csvFile = sys.argv[1]
+    indexFile = sys.argv[2] if len(sys.argv) == 3 else os.path.splitext(csvFile)[0] + '.idx'
+    print('%d terms written to %s' % (compile_index(csvFile, indexFile), indexFile))
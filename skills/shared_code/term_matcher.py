@@ -0,0 +1,126 @@
+# Shared code for the csv-lookup and csv-filter skills.
+# - Finds the terms of the csv file in the input string with a word level Aho-Corasick automaton.
+# - The automaton is built once from the terms list, then each text is scanned in one linear pass.
+#   The cost is the text size, not the number of terms times the text size.
+# - Matching rules are the ones the skills always used:
+#   1) An extra white space is added at the beginning and at the end of the text.
+#   2) Pontuaction is removed from the text. It is not removed from the terms.
+#   3) Text and terms are converted to lower case for the comparison. Original case is returned.
+#   4) A term is found only between white spaces, to avoid things like 'Africa' been found in 'African'.
+# - Words are the pieces between single white spaces, so a term " X Y " is found exactly where
+#   text.lower().find(" x y ") would find it.
+
+import bisect
+import re
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def prepare_text(text):
+    # Adding the extra white spaces and removing pontuaction, in this order
+    return PUNCTUATION.sub('', ' ' + text + ' ')
+
+
+class BaseMatcher:
+    # lookup() and remove() for any matcher with the terms list and a find(words) method.
+    # See TermMatcher below and the memory mapped index of shared_code/term_index.py
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, text):
+        # Returns the terms found in the text, in the csv order
+        words = prepare_text(text).lower().split(' ')
+        # First and last words are the empty strings before and after the extra white spaces
+        indexes = {index for _, _, index in self.find(words[1:-1])}
+        return [self.terms[index] for index in sorted(indexes)]
+
+    def lookup_many(self, texts):
+        # Same as lookup() for each text, with one single scan for all of them.
+        # The texts are separated by None, that is never a word of a term.
+        words = []
+        starts = []
+        for text in texts:
+            starts.append(len(words))
+            words.extend(prepare_text(text).lower().split(' ')[1:-1])
+            words.append(None)
+        indexes = [set() for _ in texts]
+        for first, _, index in self.find(words):
+            indexes[bisect.bisect_right(starts, first) - 1].add(index)
+        return [[self.terms[index] for index in sorted(found)] for found in indexes]
+
+    def remove(self, text):
+        # Returns the text without the terms found and the white spaces around them.
+        # The output string is built only once, after the single scan.
+        text = prepare_text(text)
+        words = text.split(' ')
+        removed = [False] * len(words)
+        hit = False
+        for first, last, _ in self.find([word.lower() for word in words[1:-1]]):
+            hit = True
+            # Plus one because the scan started after the first empty word
+            for position in range(first + 1, last + 1):
+                removed[position] = True
+        if not hit:
+            return text
+        return ' '.join(word for word, remove in zip(words, removed) if not remove).strip()
+
+
+class TermMatcher(BaseMatcher):
+
+    def __init__(self, terms):
+        # Terms in the csv order and case. They are the output of lookup()
+        self.terms = [str(term).strip() for term in terms]
+
+        # One state per trie node. State 0 is the root.
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        # Indexes of the terms ending in the state, and the next state with terms in the fail chain
+        self._found = [None]
+        self._link = [0]
+
+        for index, term in enumerate(terms):
+            state = 0
+            for word in str(term).lower().split(' '):
+                nextState = self._goto[state].get(word)
+                if nextState is None:
+                    nextState = len(self._goto)
+                    self._goto[state][word] = nextState
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._found.append(None)
+                    self._link.append(0)
+                state = nextState
+            if self._found[state] is None:
+                self._found[state] = []
+            self._found[state].append(index)
+
+        # Breadth first, to build the fail links from the shallower states
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for word, nextState in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(word, 0)
+                self._fail[nextState] = fail
+                self._link[nextState] = fail if self._found[fail] is not None else self._link[fail]
+                queue.append(nextState)
+
+    def find(self, words):
+        # Yields (first word, last word + 1, term index) for every occurrence, overlapping ones included
+        goto = self._goto
+        fail = self._fail
+        state = 0
+        for position, word in enumerate(words):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            found = state if self._found[state] is not None else self._link[state]
+            while found:
+                length = self._depth[found]
+                for index in self._found[found]:
+                    yield position + 1 - length, position + 1, index
+                found = self._link[found]
@@ -0,0 +1,56 @@
+# Shared code for the csv-lookup and csv-filter skills.
+# - Keeps the terms of the csv file, already compiled into a TermMatcher, in a global variable.
+#   The Azure Functions runtime often reuses the same process, so the file is not read on every request.
+# - The file is read again only when its modification time or size changes. Just deploy a new terms.csv.
+# - Reloads are protected by a lock: concurrent invocations wait for one reload instead of doing their own.
+# - stats() returns how many times the cache was used (hits) and how many times the file was read (reloads).
+# - If there is a terms.idx file, compiled by shared_code/term_index.py, it is memory mapped instead of
+#   reading terms.csv. The csv file is the fallback when there is no index file.
+
+import csv
+import logging
+import os
+import threading
+from shared_code import term_index, term_matcher
+
+
+class TermsCache:
+
+    def __init__(self, path, encoding='latin-1'):
+        self.path = path
+        self.indexPath = os.path.splitext(path)[0] + '.idx'
+        self.encoding = encoding
+        self._lock = threading.Lock()
+        self._signature = None
+        self._matcher = None
+        self._hits = 0
+        self._reloads = 0
+
+    def get(self):
+        # Returns the matcher of the current version of the file
+        source = self.indexPath if os.path.exists(self.indexPath) else self.path
+        stat = os.stat(source)
+        signature = (source, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if signature != self._signature:
+                self._matcher = self._load(source)
+                self._signature = signature
+                self._reloads += 1
+            else:
+                self._hits += 1
+            return self._matcher
+
+    def _load(self, source):
+        if source == self.indexPath:
+            if os.path.exists(self.path) and os.stat(self.path).st_mtime > os.stat(source).st_mtime:
+                logging.warning('%s is older than %s, compile it again.', self.indexPath, self.path)
+            return term_index.MappedTermIndex(source)
+        with open(self.path, 'r', encoding=self.encoding) as csvList:
+            myList = list(csv.reader(csvList))
+        # One term per line, first column only. Empty lines are ignored.
+        return term_matcher.TermMatcher([term[0] for term in myList if term])
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'reloads': self._reloads, 'terms': len(self._matcher or ()),
+                    'source': self._signature[0] if self._signature else None}
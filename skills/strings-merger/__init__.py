@@ -13,42 +13,19 @@
 
 import logging
 import azure.functions as func
-import json
+from shared_code import skill_base, skill_io
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
-    try:
-        body = json.dumps(req.get_json())
-    except ValueError:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
-    
-    if body:
-        result = compose_response(body)
-        return func.HttpResponse(result, mimetype="application/json")
-    else:
-        return func.HttpResponse(
-             "Invalid body",
-             status_code=400
-        )
+    # The body is parsed only once and the output is serialized only once. See shared_code/skill_io.py
+    return skill_io.handle_request(req, compose_response)
 
 
-def compose_response(json_data):
-    values = json.loads(json_data)['values']
-    
-    # Prepare the Output before the loop
-    results = {}
-    results["values"] = []
-    
-    for value in values:
-        outputRecord = transform_value(value)
-        if outputRecord != None:
-            results["values"].append(outputRecord)
-    # Keeping the original accentuation with ensure_ascii=False
-    return json.dumps(results, ensure_ascii=False)
+def compose_response(body):
+    # The records loop is in shared_code/skill_base.py, calling transform_value for each record
+    # shared_code/skill_io.py serializes the output keeping the original accentuation
+    return skill_base.compose_response(body, transform_value)
 
 ## Perform an operation on a record
 def transform_value(value):
@@ -87,42 +64,3 @@ def transform_value(value):
                 "text": concatenated_string
                     }
             })
-
-
-# Testing the function, forcing one error for the second record. 
-# Third record is an empty string. It will work.
-
-myInput = {
-    "values": [
-      {
-        "recordId": "0",
-        "data":
-           {
-             "string1": "Flamengo is",
-             "string2": "the new champion"
-           }
-      },
-        
-      {
-        "recordId": "1",
-        "data":
-           {
-            "string1": "Flamengo_Libertadores_2019.jpg"
-            }
-      },
-        {
-        "recordId": "2",
-        "data":
-           {
-            "string1": "Flamengo_Libertadores_2019.jpg",
-            "string2": "",
-
-            }
-        },
-
-
-    ]
-}
-
-inputTest = json.dumps(myInput)
-compose_response (inputTest)